@@ -0,0 +1,612 @@
+"""
+    Benchmarks for the data handling side of the dashboard
+
+    Generates synthetic CFTC shaped report files so the timings don't depend
+    on the network or on which years happen to be cached, then times the
+    functions in support_functions against them.
+
+    The suite command runs through the whole pipeline - reading, processing,
+    every chart builder and every dashboard callback - and writes the
+    timings, peak memory and figure sizes out as JSON.  Pass a previous run
+    as --baseline to see what got faster or slower.
+
+    Usage:
+        python benchmark.py aggregate --years 3 10 17 --markets 260
+        python benchmark.py lines --years 17 --points 0 500 250 100
+        python benchmark.py suite --years 3 --markets 260 --output after.json \
+            --baseline before.json
+
+"""
+import argparse
+import inspect
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.io as pio
+import plotly.utils
+import report_schemas as rs
+import support_functions as sf
+
+#############################################################################
+# Synthetic data
+#############################################################################
+# Columns the dashboard reads from each report (minus the name and date)
+deacot_columns = rs.usecols("deacot")[2:]
+da_columns = rs.usecols("da")[2:]
+
+# The real files carry a lot of columns we never look at
+# Pad the synthetic ones out to roughly the same width
+deacot_width = 130
+da_width = 190
+
+
+# Make up a list of market names shaped like the real ones
+def synthetic_markets(markets):
+    names = ["SILVER - COMMODITY EXCHANGE INC."]
+    for i in range(1, markets):
+        names.append("COMMODITY " + str(i) + " - EXCHANGE " + str(i % 12))
+    return names
+
+
+# Build one year of a report
+def synthetic_year(year, names, name_col, date_col, columns, width, rng):
+    # Reports are as of each Tuesday
+    first = date(year, 1, 1)
+    first += timedelta(days=(1 - first.weekday()) % 7)
+    dates = []
+    while first.year == year:
+        dates.append(first.isoformat())
+        first += timedelta(days=7)
+
+    rows = len(names) * len(dates)
+    data = {
+        name_col: np.repeat(names, len(dates)),
+        date_col: np.tile(dates, len(names)),
+    }
+    for col in columns:
+        if "%" in col or "Pct" in col:
+            data[col] = np.round(rng.random(rows) * 50, 1)
+        else:
+            data[col] = rng.integers(0, 250000, rows)
+    for i in range(width - len(data)):
+        data["Unused_" + str(i)] = rng.integers(0, 1000, rows)
+    return pd.DataFrame(data)
+
+
+# Write out yearly files for both reports into path
+# Returns the list of years written so it can be used as analysis_years
+def make_synthetic_reports(path, years=3, markets=260, seed=0):
+    rng = np.random.default_rng(seed)
+    names = synthetic_markets(markets)
+    year_list = [str(y) for y in range(2022 - years + 1, 2023)]
+    for y in year_list:
+        df = synthetic_year(
+            int(y),
+            names,
+            "Market and Exchange Names",
+            "As of Date in Form YYYY-MM-DD",
+            deacot_columns,
+            deacot_width,
+            rng,
+        )
+        df.to_csv(os.path.join(path, "deacot" + y + ".txt"), index=False)
+        df = synthetic_year(
+            int(y),
+            names,
+            "Market_and_Exchange_Names",
+            "Report_Date_as_YYYY-MM-DD",
+            da_columns,
+            da_width,
+            rng,
+        )
+        df.to_csv(os.path.join(path, "deacot_DA_" + y + ".txt"), index=False)
+    return year_list
+
+
+#############################################################################
+# Measurement helpers
+#############################################################################
+# Peak resident memory of this process in MB
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+# The old loader - reads every column with inferred dtypes and grows the
+# frame one year at a time
+# Kept here so the benchmark has something to compare against
+def aggregate_reports_serial(report_name, years):
+    df = pd.DataFrame()
+    for file_path in sf.report_files(report_name, years):
+        df1 = pd.read_csv(file_path, na_values="x", low_memory=False)
+        df = pd.concat([df, df1], ignore_index=True)
+    return df
+
+
+aggregate_methods = {
+    "serial append": aggregate_reports_serial,
+    "single concat": lambda report, years: sf.aggregate_reports(
+        report, years, workers=1
+    ),
+    "parallel concat": lambda report, years: sf.aggregate_reports(report, years),
+}
+
+
+# Run one aggregate case - called in a fresh process so peak RSS is its own
+def aggregate_case(path, years, method, queue):
+    sf.base_path = path
+    start_rss = peak_rss_mb()
+    start = time.perf_counter()
+    df = aggregate_methods[method]("da", years)
+    queue.put(
+        {
+            "rows": len(df),
+            "frame_mb": df.memory_usage(deep=True).sum() / (1024 * 1024),
+            "seconds": time.perf_counter() - start,
+            "peak_rss_mb": peak_rss_mb(),
+            "rss_growth_mb": peak_rss_mb() - start_rss,
+        }
+    )
+
+
+#############################################################################
+# Benchmarks
+#############################################################################
+def bench_aggregate(args):
+    ctx = multiprocessing.get_context("spawn")
+    print(
+        "{:>5} {:>16} {:>9} {:>9} {:>9} {:>12} {:>12}".format(
+            "years", "method", "rows", "seconds", "frame MB", "peak RSS MB", "growth MB"
+        )
+    )
+    for years in args.years:
+        with tempfile.TemporaryDirectory() as path:
+            path = path + os.sep
+            year_list = make_synthetic_reports(path, years, args.markets)
+            for method in aggregate_methods:
+                queue = ctx.Queue()
+                proc = ctx.Process(
+                    target=aggregate_case, args=(path, year_list, method, queue)
+                )
+                proc.start()
+                result = queue.get()
+                proc.join()
+                print(
+                    "{:>5} {:>16} {:>9} {:>9.2f} {:>9.1f} {:>12.1f} {:>12.1f}".format(
+                        years,
+                        method,
+                        result["rows"],
+                        result["seconds"],
+                        result["frame_mb"],
+                        result["peak_rss_mb"],
+                        result["rss_growth_mb"],
+                    )
+                )
+
+
+# The long time series charts, by the name used in main.chart_builders
+line_charts = {
+    "deacot_sent": lambda df_deacot, df_da: sf.make_sentiment_chart(df_deacot, ""),
+    "da_sent": lambda df_deacot, df_da: sf.make_chart_DA(df_da, "", "Contracts"),
+    "da_pos_all": lambda df_deacot, df_da: sf.make_net_DA_pos(df_da, "", "Contracts"),
+    "da_pos_pct": lambda df_deacot, df_da: sf.make_net_DA(df_da, "", "Contracts"),
+}
+
+
+# Payload size and build + serialize time for the line charts at each
+# line_max_points setting.  Time in the browser scales with the point count.
+def bench_lines(args):
+    with tempfile.TemporaryDirectory() as path:
+        path = path + os.sep
+        sf.base_path = path
+        year_list = make_synthetic_reports(path, args.years, args.markets)
+        df_deacot = sf.deacot_process(sf.aggregate_reports("deacot", year_list))
+        df_da = sf.DA_process(sf.aggregate_reports("da", year_list))
+    data = sf.index_reports(df_deacot, df_da)
+    code = data["exchange_codes"][synthetic_markets(1)[0]]
+    df_deacot = data["df_deacot"].iloc[slice(*data["deacot_index"][code])]
+    df_da = data["df_da"].iloc[slice(*data["da_index"][code])]
+
+    print(
+        "{:>6} {:>12} {:>8} {:>10} {:>10}".format(
+            "points", "chart", "traces", "bytes", "ms"
+        )
+    )
+    for points in args.points:
+        sf.line_max_points = points
+        for chart, build in line_charts.items():
+            start = time.perf_counter()
+            for i in range(args.repeat):
+                fig = build(df_deacot, df_da)
+                payload = pio.to_json(fig, validate=False)
+            seconds = (time.perf_counter() - start) / args.repeat
+            print(
+                "{:>6} {:>12} {:>8} {:>10,} {:>10.1f}".format(
+                    points or len(df_da),
+                    chart,
+                    len(fig.data),
+                    len(payload),
+                    seconds * 1000,
+                )
+            )
+
+
+#############################################################################
+# Suite
+#############################################################################
+# Size of a callback result or figure as Dash would send it
+def payload_bytes(result):
+    if result is None:
+        return None
+    return len(json.dumps(result, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+# Time func over repeat runs, then run it once more under tracemalloc for its
+# peak memory - tracing slows the small allocations down too much to time it
+# at the same time.  reset is called before every run so caches start cold.
+# payload adds the size of what func returns as Dash would send it.
+# Returns the result for the JSON and func's return value
+def measure(group, name, func, repeat, reset=None, payload=False):
+    result = {"group": group, "name": name}
+    times = []
+    value = None
+    try:
+        for i in range(repeat):
+            if reset is not None:
+                reset()
+            start = time.perf_counter()
+            value = func()
+            times.append(time.perf_counter() - start)
+        if reset is not None:
+            reset()
+        tracemalloc.start()
+        try:
+            func()
+            result["peak_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        finally:
+            tracemalloc.stop()
+    except Exception as err:
+        result["error"] = type(err).__name__ + ": " + str(err)
+        print("{:<12} {:<36} failed - {}".format(group, name, result["error"]))
+        return result, value
+
+    result["seconds_min"] = min(times)
+    result["seconds_median"] = statistics.median(times)
+    result["payload_bytes"] = payload_bytes(value) if payload else None
+    size = result["payload_bytes"]
+    print(
+        "{:<12} {:<36} {:>10.1f} {:>10.1f} {:>10.1f} {:>12}".format(
+            group,
+            name,
+            result["seconds_min"] * 1000,
+            result["seconds_median"] * 1000,
+            result["peak_mb"],
+            "" if size is None else "{:,}".format(size),
+        )
+    )
+    return result, value
+
+
+# Arguments for each chart builder in support_functions
+# Anything named make_* or da_3d_surface* without an entry here is reported
+# as missing so new charts don't silently drop out of the suite
+def figure_cases(data, exchange, markets):
+    df_deacot = data["deacot"]
+    df_da = data["da"]
+    rolling_deacot = data["deacot_rolling"]
+    rolling_da = data["da_rolling"]
+    asset = exchange.split(" - ")[0]
+    overlays = ("mean", "band", "change")
+    window = sf.rolling_windows[0]
+    return {
+        "make_chart": lambda: sf.make_chart(df_deacot, asset, "Contracts"),
+        "make_sentiment_chart": lambda: sf.make_sentiment_chart(df_deacot, asset),
+        "make_sentiment_chart+overlays": lambda: sf.make_sentiment_chart(
+            df_deacot, asset, rolling_deacot, overlays, window
+        ),
+        "make_chart_DA": lambda: sf.make_chart_DA(df_da, asset, "Contracts"),
+        "make_barchart_DA": lambda: sf.make_barchart_DA(
+            df_da.iloc[-1:], asset, "Contracts"
+        ),
+        "make_diff_barchart_DA": lambda: sf.make_diff_barchart_DA(
+            df_da.iloc[-2:], asset, "Contracts"
+        ),
+        "make_diff_barchart_DA_actual": lambda: sf.make_diff_barchart_DA_actual(
+            df_da.iloc[-2:], asset, "Contracts"
+        ),
+        # What the diff charts show for a market with a single report
+        "make_empty_chart": lambda: sf.make_diff_barchart_DA(
+            df_da.iloc[-1:], asset, "Contracts"
+        ),
+        "make_net_DA": lambda: sf.make_net_DA(df_da, asset, "Contracts"),
+        "make_net_DA_pos": lambda: sf.make_net_DA_pos(df_da, asset, "Contracts"),
+        "make_net_DA_pos+overlays": lambda: sf.make_net_DA_pos(
+            df_da, asset, "Contracts", rolling_da, overlays, window
+        ),
+        "make_net_DA_compare": lambda: sf.make_net_DA_compare(
+            data["compare"], markets, "pct"
+        ),
+        "make_correlation_heatmap": lambda: sf.make_correlation_heatmap(
+            *data["correlation"], "Correlation"
+        ),
+        "da_3d_surface": lambda: sf.da_3d_surface(df_da, asset),
+        "da_3d_surface_all": lambda: sf.da_3d_surface_all(df_da, asset),
+    }
+
+
+# Arguments for each Dash callback in main.py, called directly
+def callback_cases(main, exchange, markets):
+    week = None
+    return {
+        "display_page": lambda: main.display_page("/"),
+        "toggle_modal": lambda: main.toggle_modal(1, None, False),
+        "data_loaded": lambda: main.data_loaded(1, exchange, None, None, None),
+        "commodity_charts": lambda: main.commodity_charts(exchange),
+        "overlay_chart_figures": lambda: main.overlay_chart_figures(
+            exchange, ["mean", "band", "change"], sf.rolling_windows[0]
+        ),
+        "da_3d_position_net": lambda: main.da_3d_position_net(exchange, week),
+        "da_3d_position_all": lambda: main.da_3d_position_all(exchange, week),
+        "screener_rows": lambda: main.screener_rows("money", 1, None),
+        "compare_loaded": lambda: main.compare_loaded(1, None),
+        "compare_net": lambda: main.compare_net(markets, "pct", None),
+        "correlation_loaded": lambda: main.correlation_loaded(1, None),
+        "correlation_heatmap": lambda: main.correlation_heatmap(
+            "money", sf.correlation_windows[-1], "changes", [], None
+        ),
+    }
+
+
+# Report any builders or callbacks the suite doesn't cover
+def check_coverage(kind, found, cases):
+    missing = sorted(set(found) - {name.split("+")[0] for name in cases})
+    for name in missing:
+        print("No benchmark case for " + kind + " " + name)
+    return missing
+
+
+def bench_suite(args):
+    results = []
+    print(
+        "{:<12} {:<36} {:>10} {:>10} {:>10} {:>12}".format(
+            "group", "name", "min ms", "median ms", "peak MB", "bytes"
+        )
+    )
+    with tempfile.TemporaryDirectory() as path:
+        path = path + os.sep
+        year_list = make_synthetic_reports(path, args.years, args.markets)
+        sf.base_path = path
+        sf.cache_path = path + "processed" + os.sep
+        sf.analysis_years = year_list
+        # Nothing in the background and no figures built ahead of the timings
+        sf.auto_refresh = False
+        sf.shared_data = False
+        sf.warm_figures = False
+
+        ###########################################
+        # Reading and processing
+        ###########################################
+        raw = {}
+        for report_name in ["deacot", "da"]:
+            result, raw[report_name] = measure(
+                "ingest",
+                "aggregate_reports " + report_name,
+                lambda: sf.aggregate_reports(report_name, year_list),
+                args.repeat,
+            )
+            results.append(result)
+        # The processors work on the frame they are given, so each run gets
+        # a fresh copy
+        processed = {}
+        for name, report_name, process in [
+            ("deacot_process", "deacot", sf.deacot_process),
+            ("DA_process", "da", sf.DA_process),
+        ]:
+            result, processed[report_name] = measure(
+                "processing",
+                name,
+                lambda: process(raw[report_name].copy()),
+                args.repeat,
+            )
+            results.append(result)
+        results.append(
+            measure(
+                "processing",
+                "index_reports",
+                lambda: sf.index_reports(processed["deacot"], processed["da"]),
+                args.repeat,
+            )[0]
+        )
+
+        # Importing main loads the synthetic reports on its background thread
+        import business_logic as bl
+        import main
+        import rolling_stats as rst
+        import screener as sc
+
+        if not bl.wait_until_ready(600) or bl.data is None:
+            raise RuntimeError("Dashboard data didn't load: " + bl.status)
+
+        for report_name in ["deacot", "da"]:
+            df = bl.data["df_" + report_name]
+            results.append(
+                measure(
+                    "processing",
+                    "rolling_stats.compute " + report_name,
+                    lambda: rst.compute(df, report_name),
+                    args.repeat,
+                )[0]
+            )
+        results.append(
+            measure(
+                "processing",
+                "screener.build",
+                lambda: sc.build(bl.data["df_da"]),
+                args.repeat,
+            )[0]
+        )
+
+        ###########################################
+        # Chart builders
+        ###########################################
+        exchange = synthetic_markets(1)[0]
+        markets = bl.top_exchanges(args.compare)
+        data = {
+            "deacot": bl.get_deacot(exchange),
+            "da": bl.get_da(exchange),
+            "deacot_rolling": bl.get_rolling("deacot", exchange),
+            "da_rolling": bl.get_rolling("da", exchange),
+            "compare": bl.get_da_many(markets),
+            "correlation": bl.correlation_matrix("money", sf.correlation_windows[-1]),
+        }
+        cases = figure_cases(data, exchange, markets)
+        builders = [
+            name
+            for name, func in inspect.getmembers(sf, inspect.isfunction)
+            if func.__module__ == sf.__name__
+            and (name.startswith("make_") or name.startswith("da_3d_surface"))
+        ]
+        missing = check_coverage("chart builder", builders, cases)
+        for name, build in cases.items():
+            results.append(
+                measure("figures", name, build, args.repeat, payload=True)[0]
+            )
+
+        ###########################################
+        # Callbacks
+        ###########################################
+        def cold():
+            main.figure_cache.clear()
+            main.figure_store.clear()
+            bl.data["views"].clear()
+
+        cases = callback_cases(main, exchange, markets)
+        callbacks = [
+            callback["callback"].__name__
+            for callback in main.app.callback_map.values()
+        ]
+        missing += check_coverage("callback", callbacks, cases)
+        for name, callback in cases.items():
+            results.append(
+                measure(
+                    "callbacks", name, callback, args.repeat, cold, payload=True
+                )[0]
+            )
+
+    run = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "years": args.years,
+            "markets": args.markets,
+            "repeat": args.repeat,
+            "rows": {
+                "deacot": len(bl.data["df_deacot"]),
+                "da": len(bl.data["df_da"]),
+            },
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "plotly": plotly.__version__,
+            "missing_cases": missing,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(run, f, indent=2)
+    print("Results written to " + args.output)
+
+    if args.baseline:
+        compare_runs(args.baseline, run)
+
+
+# Median times against an earlier run - anything more than 10% slower is
+# flagged
+def compare_runs(baseline_file, run):
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    before = {
+        (r["group"], r["name"]): r
+        for r in baseline["results"]
+        if "seconds_median" in r
+    }
+    print()
+    print(
+        "{:<12} {:<36} {:>10} {:>10} {:>8}".format(
+            "group", "name", "before ms", "after ms", "ratio"
+        )
+    )
+    for result in run["results"]:
+        old = before.get((result["group"], result["name"]))
+        if old is None or "seconds_median" not in result:
+            continue
+        ratio = result["seconds_median"] / old["seconds_median"]
+        print(
+            "{:<12} {:<36} {:>10.1f} {:>10.1f} {:>7.2f}x{}".format(
+                result["group"],
+                result["name"],
+                old["seconds_median"] * 1000,
+                result["seconds_median"] * 1000,
+                ratio,
+                "  slower" if ratio > 1.1 else "",
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    aggregate = commands.add_parser(
+        "aggregate", help="time aggregate_reports for several year counts"
+    )
+    aggregate.add_argument("--years", type=int, nargs="+", default=[3, 10, 17])
+    aggregate.add_argument("--markets", type=int, default=260)
+    aggregate.set_defaults(func=bench_aggregate)
+
+    lines = commands.add_parser(
+        "lines", help="payload size and build time of the line charts"
+    )
+    lines.add_argument("--years", type=int, default=17)
+    lines.add_argument("--markets", type=int, default=20)
+    lines.add_argument(
+        "--points",
+        type=int,
+        nargs="+",
+        default=[0, 500, 250, 100],
+        help="line_max_points settings to compare (0 sends every point)",
+    )
+    lines.add_argument("--repeat", type=int, default=5)
+    lines.set_defaults(func=bench_lines)
+
+    suite = commands.add_parser(
+        "suite", help="time ingest, processing, chart builders and callbacks"
+    )
+    suite.add_argument("--years", type=int, default=3)
+    suite.add_argument("--markets", type=int, default=260)
+    suite.add_argument("--repeat", type=int, default=5)
+    suite.add_argument(
+        "--compare",
+        type=int,
+        default=4,
+        help="number of markets on the comparison chart",
+    )
+    suite.add_argument("--output", default="benchmark.json")
+    suite.add_argument("--baseline", help="earlier --output to compare against")
+    suite.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -5,34 +5,316 @@
 
     This is called by main.py and in turn calls support functions when needed
 
+    The reports are loaded on a background thread when this file is imported
+    so the dashboard can start serving straight away.  Until the first load
+    finishes, data is None and ready is not set.  A second thread then picks
+    up each weekly CFTC release as it comes out and swaps it in.
+
 """
+import threading
+import time
 import pandas as pd
 import numpy as np
 import plotly.io as pio
+import correlation as co
+import rolling_stats as rst
+import screener as sc
 import support_functions as sf
+import shared_data as shd
 
 pd.options.plotting.backend = "plotly"
 pio.templates.default = "plotly_dark"
 
-# Make sure we have data
-# This will check to see if a file exists and if not gets one
-#  This also checks the data freshness
-sf.get_reports()
+#############################################################################
+# Data set being served
+#############################################################################
+# Everything is held in one dict that is replaced whole, so a reader that
+# grabs it once sees a consistent set of frames and indexes.  The lookups
+# below take that snapshot as current - anything building from several of
+# them (or caching by data_version) should grab data once and pass it in.
+# Keys: df_deacot, deacot_index, df_da, da_index, exchange_codes, da_list,
+# da_weeks, screener, deacot_rolling, da_rolling, rolling_states,
+# rolling_windows, views, data_version
+data = None
+
+# Changes whenever the data set is replaced
+# Anything caching results built from the data should include it in its key
+data_version = None
+
+# Set once the first data set is in place
+ready = threading.Event()
+
+# What the loader is up to - shown on the dashboard until the data is ready
+status = "Loading report data..."
+
+# Functions to call each time a new data set is put in place
+_listeners = []
+
+
+# Put a new data set in place
+def set_data(new_data):
+    global data, data_version
+
+    ####################################################
+    # Generate the commodities list - use the DA listing
+    ####################################################
+    # Every market with rows in the DA report, in code (alphabetical) order
+    da_index = new_data["da_index"]
+    names = np.array(list(new_data["exchange_codes"]), dtype=object)
+    new_data["da_list"] = names[da_index[:, 1] > da_index[:, 0]]
+
+    # Week numbers of every DA row, for the range slider lookups
+    new_data["da_weeks"] = new_data["df_da"]["week_number"].to_numpy()
+
+    # The screener and the rolling statistics for the chart overlays come
+    # with data published by a shared loader.  Otherwise they're rolled
+    # forward from the current data, so only a new week is worked out.
+    sc.add_screener(new_data, data)
+    rst.add_rolling(new_data, data)
+
+    # Commodity views are memoized per data set so none outlive it
+    new_data["views"] = {}
+
+    # The data goes in before the version so anything keyed on the new
+    # version is always built from the new data
+    data = new_data
+    data_version = new_data["data_version"]
+    ready.set()
+
+    # The listeners run on the caller's thread once the new data is being
+    # served.  One failing is logged rather than passed on, so the data
+    # isn't loaded again over a listener's error.
+    for listener in _listeners:
+        try:
+            listener()
+        except Exception as err:
+            print("Data loaded listener failed: " + repr(err))
+
+
+# Register a function to run whenever new data is put in place
+# Runs it straight away if the data is already loaded
+def on_data_loaded(listener):
+    _listeners.append(listener)
+    if ready.is_set():
+        listener()
+
 
 # Get the data frames to work with
-# DEACOT report
-df_deacot = sf.aggregate_reports("deacot")
-df_deacot = sf.deacot_process(df_deacot)
+# Attach to the shared copy when a shared_data.py loader is running,
+# otherwise retrieve and process the reports in this process
+# A failed load is tried again, waiting twice as long each time up to
+# sf.load_retry seconds, until it works
+def load_data():
+    global status
+    wait = min(60, sf.load_retry)
+    while True:
+        try:
+            new_data = None
+            if sf.shared_data:
+                new_data = shd.attach(sf.shared_data_name)
+                if new_data is None:
+                    print("No shared data published - loading reports in this process")
+            if new_data is None:
+                status = "Retrieving and processing report data..."
+                new_data = sf.load_reports()
+            set_data(new_data)
+            status = "Ready"
+            return
+        except Exception as err:
+            status = (
+                "Unable to load report data: "
+                + str(err)
+                + " - trying again in "
+                + str(wait)
+                + " seconds"
+            )
+            print(status)
+        time.sleep(wait)
+        wait = min(wait * 2, sf.load_retry)
+
+
+# Pick up a new release - from the shared loader if there is one, otherwise
+# in this process
+# Returns True if a new data set was put in place
+def refresh_data():
+    new_data = None
+    if sf.shared_data:
+        # Leave the work to the loader when there is one, and only attach
+        # once it has published something new
+        version = shd.published_version(sf.shared_data_name)
+        if version == data_version:
+            return False
+        if version is not None:
+            new_data = shd.attach(sf.shared_data_name)
+    if new_data is None:
+        new_data = sf.refresh_reports(data)
+    if new_data is None or new_data["data_version"] == data_version:
+        return False
+    set_data(new_data)
+    return True
+
+
+# Check for a new release whenever one is due, and keep checking every
+# sf.refresh_retry seconds while it is late
+def refresh_loop():
+    ready.wait()
+    # No new release adds anything once the analysis years are over
+    if sf.years_finished():
+        print("Analysis years have ended - not checking for new releases")
+        return
+    while True:
+        # A failed refresh is logged and tried again at the next check rather
+        # than stopping the thread
+        try:
+            if sf.is_behind(data):
+                if refresh_data():
+                    print("Now serving data version " + data_version)
+        except Exception as err:
+            print("Refreshing report data failed: " + repr(err))
+        # Let go of the shared segments of versions no longer served
+        if sf.shared_data:
+            shd.release(data_version)
+        time.sleep(sf.refresh_wait())
+
+
+def start_loading():
+    loader = threading.Thread(target=load_data, name="report-loader", daemon=True)
+    loader.start()
+    if sf.auto_refresh:
+        threading.Thread(
+            target=refresh_loop, name="report-refresher", daemon=True
+        ).start()
+    return loader
+
+
+# Block until the data is loaded (or timeout seconds pass)
+def wait_until_ready(timeout=None):
+    return ready.wait(timeout)
 
-# Disambiguation report
-df_da = sf.aggregate_reports("da")
-df_da = sf.DA_process(df_da)
 
 ####################################################
-# Generate the commodities list - use the DA listing
+# Commodity lookups - rows for one Exchange, oldest first, indexed by Date
 ####################################################
-da_list = df_da["Exchange"].unique()
-da_list = np.sort(da_list)
+# Integer code for a market name, or None if it isn't in either report
+def exchange_code(exchange, current=None):
+    current = data if current is None else current
+    return current["exchange_codes"].get(exchange)
+
+
+# Slice one Exchange out of a report by its code
+def report_rows(current, report_name, exchange):
+    df = current["df_" + report_name]
+    code = exchange_code(exchange, current)
+    if code is None:
+        return df.iloc[0:0]
+    start, stop = current[report_name + "_index"][code]
+    return df.iloc[start:stop]
+
+
+def get_deacot(exchange, current=None):
+    return report_rows(data if current is None else current, "deacot", exchange)
+
+
+def get_da(exchange, current=None):
+    return report_rows(data if current is None else current, "da", exchange)
+
+
+# Rolling statistics for one Exchange - the same rows as get_deacot / get_da
+def get_rolling(report_name, exchange, current=None):
+    current = data if current is None else current
+    frame = current[report_name + "_rolling"]
+    code = exchange_code(exchange, current)
+    if code is None:
+        return frame.iloc[0:0]
+    start, stop = current[report_name + "_index"][code]
+    return frame.iloc[start:stop]
+
+
+# DA rows for several Exchanges, taken from the frame in one go
+def get_da_many(exchanges, current=None):
+    current = data if current is None else current
+    ranges = [
+        current["da_index"][code]
+        for code in (exchange_code(e, current) for e in exchanges)
+        if code is not None
+    ]
+    rows = [np.arange(start, stop) for start, stop in ranges]
+    return current["df_da"].iloc[np.concatenate(rows) if rows else []]
+
+
+# DA rows for one Exchange with a week_number from first_week to last_week
+# Week numbers rise with the dates inside an Exchange's rows, so both ends
+# are a binary search over just that Exchange's weeks.  The result is a
+# positional slice of the full frame - a view rather than a copy.
+def get_da_weeks(exchange, first_week, last_week, current=None):
+    current = data if current is None else current
+    code = exchange_code(exchange, current)
+    if code is None:
+        return current["df_da"].iloc[0:0]
+    start, stop = current["da_index"][code]
+    weeks = current["da_weeks"][start:stop]
+    first = start + np.searchsorted(weeks, first_week, side="left")
+    last = start + np.searchsorted(weeks, last_week, side="right")
+    return current["df_da"].iloc[first:last]
+
+
+# The full list of markets for the dropdown
+def commodity_list(current=None):
+    current = data if current is None else current
+    if current is None:
+        return []
+    return current["da_list"]
+
+
+# First and last week numbers across the DA report
+def week_bounds(current=None):
+    current = data if current is None else current
+    weeks = current["df_da"]["week_number"]
+    return int(weeks.min()), int(weeks.max())
+
+
+# The n largest markets by open interest in their latest report
+def top_exchanges(n, current=None):
+    if n <= 0:
+        return []
+    current = data if current is None else current
+    starts, stops = current["da_index"].T
+    codes = np.flatnonzero(stops > starts)
+    open_interest = current["df_da"]["Open_Interest"].to_numpy()[stops[codes] - 1]
+    order = np.argsort(open_interest, kind="stable")[::-1][:n]
+    names = list(current["exchange_codes"])
+    return [names[code] for code in codes[order]]
+
+
+# Screener results for one trader class across every market
+def screener_table(class_name, current=None):
+    current = data if current is None else current
+    return current["screener"].table(class_name)
+
+
+# Correlations of one trader class's net position across markets
+# Returns the market names and their correlation matrix
+def correlation_matrix(class_name, weeks, changes=True, exchanges=None, current=None):
+    current = data if current is None else current
+    return co.correlations(current["df_da"], class_name, weeks, changes, exchanges)
+
+
+# Everything the charts need for one commodity: the DEACOT rows, the DA rows
+# and the commodity name for titles
+# Memoized in the data set itself so the callbacks for a selection share one
+# lookup and a view is never served with another data set's version
+def commodity_view(exchange, current=None):
+    current = data if current is None else current
+    view = current["views"].get(exchange)
+    if view is None:
+        asset = exchange.split(" - ")[0]
+        view = get_deacot(exchange, current), get_da(exchange, current), asset
+        current["views"][exchange] = view
+    return view
+
+
+# Start pulling the data in as soon as we're imported
+start_loading()
 
 #############################################################################
 # Backstop
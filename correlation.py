@@ -0,0 +1,77 @@
+"""
+Cross-market correlations
+
+How closely one trader class's net position moves together across every
+pair of markets - do gold's money managers trade like silver's?
+
+The class's net positions over the last few report weeks are laid out as a
+(week, market) matrix, the same way the screener lays them out.  By default
+the week-over-week changes are correlated rather than the net levels, as
+most markets' levels trend and would look related whether they are or not.
+
+Markets don't all report every week, so each pair is measured over just the
+weeks both reported.  That is done for every pair at once with a handful of
+matrix products over the values and their missing-value mask, rather than a
+loop over the pairs.  Pairs sharing fewer than sf.correlation_min_weeks weeks
+are left blank.
+"""
+import numpy as np
+import screener as sc
+import support_functions as sf
+
+
+# Pearson correlation between every pair of columns in x, each pair over the
+# rows where both have a value
+# Returns the correlations and the number of rows each pair shares
+def pairwise_correlation(x, min_weeks=None):
+    if min_weeks is None:
+        min_weeks = sf.correlation_min_weeks
+    valid = ~np.isnan(x)
+    mask = valid.astype("float64")
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Centre each column on its own mean first so the sums stay small
+        count = mask.sum(axis=0)
+        mean = np.where(valid, x, 0.0).sum(axis=0) / count
+        x = np.where(valid, x - mean, 0.0)
+
+        # [i, j] sums column i over the rows column j also has a value in
+        shared = mask.T @ mask
+        sums = x.T @ mask
+        squares = (x**2).T @ mask
+        products = x.T @ x
+
+        covariance = products - sums * sums.T / shared
+        variance = squares - sums**2 / shared
+        result = covariance / np.sqrt(variance * variance.T)
+
+    # A market with no movement in the shared weeks has nothing to correlate
+    result[~np.isfinite(result) | (shared < min_weeks)] = np.nan
+    return np.clip(result, -1, 1), shared
+
+
+# Correlations of one trader class's net position across markets
+# weeks is how many report weeks to measure over, changes picks correlating
+# the week-over-week changes (True) or the net levels.  exchanges limits the
+# result to those markets, in that order - otherwise every market with
+# enough weeks in the window is included, alphabetically.
+# Returns the market names and their correlation matrix
+def correlations(df_da, class_name, weeks, changes=True, exchanges=None):
+    markets = df_da["Exchange"].cat.categories
+    # One more date when correlating changes, so there are weeks of them
+    dates = np.unique(df_da.index.to_numpy())[-(weeks + 1 if changes else weeks) :]
+    in_window = df_da.index >= dates[0]
+    window = sc.net_array(df_da[in_window], dates, len(markets))
+    values = window[:, :, list(sc.classes).index(class_name)]
+    if changes:
+        values = np.diff(values, axis=0)
+
+    if exchanges:
+        codes = markets.get_indexer(exchanges)
+        codes = codes[codes >= 0]
+    else:
+        reported = np.count_nonzero(~np.isnan(values), axis=0)
+        codes = np.flatnonzero(reported >= sf.correlation_min_weeks)
+
+    result = pairwise_correlation(values[:, codes])[0]
+    return list(markets[codes]), result
@@ -0,0 +1,117 @@
+"""
+Figure cache for the chart callbacks
+
+The report data only changes once a week, so the same commodity, chart and
+slider range always produce the same figure until new data arrives.  The
+cache holds recently built figures keyed by
+(chart, exchange, week range, data version) and drops the least recently
+used one when it is full.  Because the data version is part of the key,
+figures built from old data simply stop being asked for and age out.
+
+The figure store sits in front of the cache and holds figures that were
+built and serialized ahead of time for the most viewed markets.
+"""
+from collections import OrderedDict
+import json
+import threading
+import plotly.io as pio
+
+
+class FigureCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._figures = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Return the cached figure for key, building (and caching) it on a miss
+    def get(self, key, build):
+        with self._lock:
+            if key in self._figures:
+                self._figures.move_to_end(key)
+                self.hits += 1
+                return self._figures[key]
+            self.misses += 1
+
+        # Build outside the lock so one slow figure doesn't hold up the rest
+        fig = build()
+
+        with self._lock:
+            self._figures[key] = fig
+            self._figures.move_to_end(key)
+            while len(self._figures) > self.maxsize:
+                self._figures.popitem(last=False)
+        return fig
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+
+    # Counters for keeping an eye on how well the cache is doing
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._figures),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Figures that have already been serialized to JSON
+# The raw bytes can be handed straight out, and the decoded copy is made of
+# plain JSON types so Dash has nothing plotly specific left to convert
+# Each chart is stored in one view per exchange and data version (its
+# default week range), so the raw bytes are also kept by
+# (chart, exchange, version) for the /figure-store route
+class FigureStore:
+    def __init__(self):
+        self.hits = 0
+        self._figures = {}
+        self._bytes = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, fig):
+        raw = pio.to_json(fig, validate=False).encode()
+        with self._lock:
+            self._figures[key] = (raw, json.loads(raw))
+            self._bytes[(key[0], key[1], key[-1])] = raw
+
+    # Return the decoded figure for key, or None if it isn't stored
+    def get(self, key):
+        with self._lock:
+            entry = self._figures.get(key)
+            if entry is None:
+                return None
+            self.hits += 1
+            return entry[1]
+
+    # Return the raw bytes for a chart and exchange at the given data version
+    def get_bytes(self, chart, exchange, version):
+        with self._lock:
+            return self._bytes.get((chart, exchange, version))
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+            self._bytes.clear()
+
+    def exchanges(self):
+        with self._lock:
+            return {key[1] for key in self._figures}
+
+    def nbytes(self):
+        with self._lock:
+            return sum(len(entry[0]) for entry in self._figures.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "figures": len(self._figures),
+                "hits": self.hits,
+                "exchanges": len({key[1] for key in self._figures}),
+                "bytes": sum(len(entry[0]) for entry in self._figures.values()),
+            }
@@ -1,10 +1,15 @@
 import dash
 from dash import html
 from dash import dcc
+from dash import dash_table
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
+import flask
 import business_logic as bl
+import figure_cache as fc
 import layout_configs as lc
+import screener as sc
 import support_functions as sf
 
 #############################################################################
@@ -19,6 +24,9 @@ TEXT_STYLE = {"textAlign": "center"}
 
 DROPDOWN_STYLE = {"textAlign": "left"}
 
+# Commodity shown when the dashboard first opens
+DEFAULT_FUTURE = "SILVER - COMMODITY EXCHANGE INC."
+
 #############################################################################
 # Content
 #############################################################################
@@ -183,10 +191,11 @@ future_select = dbc.Row(
             [
                 html.Div(
                     [
+                        # Options are filled in once the data has loaded
                         dcc.Dropdown(
                             id="future",
-                            options=[{"label": i, "value": i} for i in bl.da_list],
-                            value="SILVER - COMMODITY EXCHANGE INC.",
+                            options=[],
+                            value=DEFAULT_FUTURE,
                         ),
                     ],
                     className="dash-bootstrap",
@@ -197,6 +206,55 @@ future_select = dbc.Row(
     ]
 )
 
+# Rolling overlays for the sentiment and net position charts
+overlay_select = dbc.Row(
+    [
+        dbc.Col(
+            dbc.Checklist(
+                id="overlays",
+                options=[
+                    {"label": "Rolling Mean", "value": "mean"},
+                    {"label": "Low / High Band", "value": "band"},
+                    {"label": "Rate of Change", "value": "change"},
+                ],
+                value=[],
+                inline=True,
+            ),
+            md=6,
+        ),
+        dbc.Col(
+            dbc.RadioItems(
+                id="overlay_window",
+                options=[
+                    {"label": str(w) + " weeks", "value": w}
+                    for w in sf.rolling_windows
+                ],
+                value=13 if 13 in sf.rolling_windows else sf.rolling_windows[0],
+                inline=True,
+            ),
+            md=6,
+        ),
+    ]
+)
+
+# Pages poll quickly (milliseconds) until the data is ready, then slowly to
+# pick up each refresh
+loading_poll = 2000
+loaded_poll = sf.page_poll * 1000
+
+# Loading message - polls until the data is ready, then for newer data
+# data_shown holds the data version and last week the page was filled from
+data_status = html.Div(
+    [
+        html.Div(
+            dbc.Alert(bl.status, color="info"),
+            id="data_status",
+        ),
+        dcc.Interval(id="data_poll", interval=loading_poll),
+        dcc.Store(id="data_shown"),
+    ]
+)
+
 # Info Bar
 info_bar = html.Div(
     id="summary",
@@ -273,12 +331,9 @@ da_3d_positions = dbc.Row(
                 ),
                 dcc.RangeSlider(
                     id="da_3d_net_range_slider",
-                    min=bl.df_da["week_number"].min(),
-                    max=bl.df_da["week_number"].max(),
-                    value=[
-                        bl.df_da["week_number"].min(),
-                        bl.df_da["week_number"].max(),
-                    ],
+                    # Range is set once the data has loaded
+                    min=0,
+                    max=1,
                     allowCross=False,
                 ),
             ],
@@ -298,12 +353,9 @@ da_3d_positions = dbc.Row(
                 ),
                 dcc.RangeSlider(
                     id="da_3d_all_range_slider",
-                    min=bl.df_da["week_number"].min(),
-                    max=bl.df_da["week_number"].max(),
-                    value=[
-                        bl.df_da["week_number"].min(),
-                        bl.df_da["week_number"].max(),
-                    ],
+                    # Range is set once the data has loaded
+                    min=0,
+                    max=1,
                     allowCross=False,
                 ),
             ],
@@ -385,12 +437,26 @@ references = dbc.Row(
 ####################################################
 # Layout Creation Section
 ####################################################
+# Links between the pages
+nav_bar = dbc.Nav(
+    [
+        dbc.NavLink("Dashboard", href="/"),
+        dbc.NavLink("Screener", href="/screener"),
+        dbc.NavLink("Compare", href="/compare"),
+        dbc.NavLink("Correlation", href="/correlation"),
+    ],
+    pills=True,
+)
+
 main_page = html.Div(
     [
         html.Hr(),
         html.H5("Futures Market Comparison and Analysis", style=TEXT_STYLE),
+        nav_bar,
         html.Hr(),
         future_select,
+        overlay_select,
+        data_status,
         html.Hr(),
         info_bar,
         html.Hr(),
@@ -410,6 +476,261 @@ main_page = html.Div(
     style=CONTENT_STYLE,
 )
 
+####################################################
+# Screener page
+####################################################
+screener_select = dbc.Row(
+    [
+        dbc.Col(
+            [
+                html.Div(
+                    [
+                        dcc.Dropdown(
+                            id="screener_class",
+                            options=[
+                                {"label": name, "value": key}
+                                for key, name in sc.classes.items()
+                            ],
+                            value="money",
+                            clearable=False,
+                        ),
+                    ],
+                    className="dash-bootstrap",
+                ),
+            ],
+            md=3,
+        )
+    ]
+)
+
+# Loading message for the screener - polls until the data is ready, then
+# for newer data
+# screener_shown holds the data version and class the table was filled from
+screener_status = html.Div(
+    [
+        html.Div(
+            dbc.Alert(bl.status, color="info"),
+            id="screener_status",
+        ),
+        dcc.Interval(id="screener_poll", interval=loading_poll),
+        dcc.Store(id="screener_shown"),
+    ]
+)
+
+screener_table = dash_table.DataTable(
+    id="screener_table",
+    columns=[
+        {"name": "Market", "id": "Exchange"},
+        {"name": "Latest Report", "id": "Date"},
+        {"name": "Weeks", "id": "Weeks", "type": "numeric"},
+        {"name": "Net Contracts", "id": "net", "type": "numeric"},
+        {"name": "COT Index", "id": "cot_index", "type": "numeric"},
+        {"name": "Z-Score", "id": "zscore", "type": "numeric"},
+        {"name": "Percentile", "id": "percentile", "type": "numeric"},
+    ],
+    data=[],
+    sort_action="native",
+    sort_by=[{"column_id": "cot_index", "direction": "desc"}],
+    filter_action="native",
+    page_size=50,
+    style_table={"overflowX": "auto"},
+    style_header={"backgroundColor": "rgb(30, 30, 30)", "fontWeight": "bold"},
+    style_cell={
+        "backgroundColor": "rgb(50, 50, 50)",
+        "color": "white",
+        "textAlign": "left",
+    },
+)
+
+screener_page = html.Div(
+    [
+        html.Hr(),
+        html.H5("Market Screener", style=TEXT_STYLE),
+        nav_bar,
+        html.Hr(),
+        html.P(
+            "Net positions for the selected trader class against each market's "
+            "last " + str(sf.screener_weeks) + " report weeks. "
+            "COT Index 100 is the highest net long in that time, 0 the lowest."
+        ),
+        screener_select,
+        screener_status,
+        html.Hr(),
+        screener_table,
+        html.Hr(),
+    ],
+    style=CONTENT_STYLE,
+)
+
+####################################################
+# Comparison page
+####################################################
+compare_select = dbc.Row(
+    [
+        dbc.Col(
+            [
+                html.Div(
+                    [
+                        # Options are filled in once the data has loaded
+                        dcc.Dropdown(
+                            id="compare_futures",
+                            options=[],
+                            value=[DEFAULT_FUTURE],
+                            multi=True,
+                        ),
+                    ],
+                    className="dash-bootstrap",
+                ),
+            ],
+            md=8,
+        ),
+        dbc.Col(
+            dbc.RadioItems(
+                id="compare_units",
+                options=[
+                    {"label": "Percent of OI", "value": "pct"},
+                    {"label": "Contracts", "value": "all"},
+                ],
+                value="pct",
+                inline=True,
+            ),
+            md=4,
+        ),
+    ]
+)
+
+# Loading message for the comparison - polls until the data is ready, then
+# for newer data
+compare_status = html.Div(
+    [
+        html.Div(
+            dbc.Alert(bl.status, color="info"),
+            id="compare_status",
+        ),
+        dcc.Interval(id="compare_poll", interval=loading_poll),
+        dcc.Store(id="compare_version"),
+    ]
+)
+
+compare_page = html.Div(
+    [
+        html.Hr(),
+        html.H5("Market Comparison", style=TEXT_STYLE),
+        nav_bar,
+        html.Hr(),
+        compare_select,
+        compare_status,
+        html.Hr(),
+        dcc.Graph(id="compare_net", config=lc.tool_config),
+        html.Hr(),
+    ],
+    style=CONTENT_STYLE,
+)
+
+####################################################
+# Correlation page
+####################################################
+correlation_select = dbc.Row(
+    [
+        dbc.Col(
+            [
+                html.Div(
+                    [
+                        dcc.Dropdown(
+                            id="correlation_class",
+                            options=[
+                                {"label": name, "value": key}
+                                for key, name in sc.classes.items()
+                            ],
+                            value="money",
+                            clearable=False,
+                        ),
+                    ],
+                    className="dash-bootstrap",
+                ),
+            ],
+            md=3,
+        ),
+        dbc.Col(
+            dbc.RadioItems(
+                id="correlation_weeks",
+                options=[
+                    {"label": str(w) + " weeks", "value": w}
+                    for w in sf.correlation_windows
+                ],
+                value=52 if 52 in sf.correlation_windows else sf.correlation_windows[0],
+                inline=True,
+            ),
+            md=5,
+        ),
+        dbc.Col(
+            dbc.RadioItems(
+                id="correlation_values",
+                options=[
+                    {"label": "Weekly Changes", "value": "changes"},
+                    {"label": "Net Levels", "value": "levels"},
+                ],
+                value="changes",
+                inline=True,
+            ),
+            md=4,
+        ),
+    ]
+)
+
+# Markets to limit the heatmap to - all of them when left empty
+correlation_futures = html.Div(
+    [
+        # Options are filled in once the data has loaded
+        dcc.Dropdown(
+            id="correlation_futures",
+            options=[],
+            value=[],
+            multi=True,
+            placeholder="All markets",
+        ),
+    ],
+    className="dash-bootstrap",
+)
+
+# Loading message for the correlations - polls until the data is ready, then
+# for newer data
+correlation_status = html.Div(
+    [
+        html.Div(
+            dbc.Alert(bl.status, color="info"),
+            id="correlation_status",
+        ),
+        dcc.Interval(id="correlation_poll", interval=loading_poll),
+        dcc.Store(id="correlation_version"),
+    ]
+)
+
+correlation_page = html.Div(
+    [
+        html.Hr(),
+        html.H5("Market Correlations", style=TEXT_STYLE),
+        nav_bar,
+        html.Hr(),
+        html.P(
+            "How closely the selected trader class's net position moves "
+            "together across markets over the last few report weeks."
+        ),
+        correlation_select,
+        html.Br(),
+        correlation_futures,
+        correlation_status,
+        html.Hr(),
+        dcc.Graph(
+            id="correlation_heatmap",
+            style={"height": "90vh"},
+            config=lc.tool_config,
+        ),
+        html.Hr(),
+    ],
+    style=CONTENT_STYLE,
+)
+
 #############################################################################
 # Application parameters
 #############################################################################
@@ -419,19 +740,22 @@ app = dash.Dash(
     external_stylesheets=[dbc.themes.CYBORG],
 )
 app.config.suppress_callback_exceptions = True
+# WSGI entry point for running under gunicorn and the like
+server = app.server
 app.title = "CFTC Data Analysis"
 app.layout = html.Div(
     [dcc.Location(id="url", refresh=False), html.Div(id="page-content")]
 )
 
-# Multi-page selector callback - not really used, but left in for future use
+# Multi-page selector callback
 @app.callback(Output("page-content", "children"), Input("url", "pathname"))
 def display_page(pathname):
-    # Left in because I'm not sure if this will be a muli-page app at some point
-
-    # if pathname == "/market-sentiment":
-    #     return volumes
-    # else:
+    if pathname == "/screener":
+        return screener_page
+    if pathname == "/compare":
+        return compare_page
+    if pathname == "/correlation":
+        return correlation_page
     return main_page
 
 
@@ -484,69 +808,252 @@ def toggle_modal(n1, n2, is_open):
 
 
 ####################################################
-#  Callbacks - charts
+#  Callbacks - data loading
 ####################################################
-
-# Sentiment charts
+# Keep a slider's selection across a refresh, following the new last week
+# when the selection ran to the end of the range it was shown
+def slider_weeks(week, shown, first_week, last_week):
+    if week is None or shown is None:
+        return [first_week, last_week]
+    low, high = week
+    if high >= shown["last_week"]:
+        high = last_week
+    low = min(max(low, first_week), last_week)
+    return [low, min(max(high, low), last_week)]
+
+
+# Fill in the dropdown and sliders once the data is ready, and again each
+# time a refresh brings in a newer data set
+# Setting the dropdown value is what kicks off each round of charts
 @app.callback(
-    dash.dependencies.Output("deacot_sent", "figure"),
-    [dash.dependencies.Input("future", "value")],
+    [
+        Output("data_status", "children"),
+        Output("data_poll", "interval"),
+        Output("data_shown", "data"),
+        Output("future", "options"),
+        Output("future", "value"),
+        Output("da_3d_net_range_slider", "min"),
+        Output("da_3d_net_range_slider", "max"),
+        Output("da_3d_net_range_slider", "value"),
+        Output("da_3d_all_range_slider", "min"),
+        Output("da_3d_all_range_slider", "max"),
+        Output("da_3d_all_range_slider", "value"),
+    ],
+    Input("data_poll", "n_intervals"),
+    [
+        State("future", "value"),
+        State("da_3d_net_range_slider", "value"),
+        State("da_3d_all_range_slider", "value"),
+        State("data_shown", "data"),
+    ],
 )
-def deacot_sentiment(future1):
-    df1 = bl.df_deacot[bl.df_deacot["Exchange"] == future1]
-    df1.set_index("Date", inplace=True)
+def data_loaded(n, future1, net_week, all_week, shown):
+    if not bl.ready.is_set():
+        status = dbc.Alert(bl.status, color="info")
+        return [status, loading_poll] + [dash.no_update] * 9
+
+    current = bl.data
+    version = current["data_version"]
+    if shown is not None and shown["version"] == version:
+        raise PreventUpdate
+
+    first_week, last_week = bl.week_bounds(current)
+    return [
+        None,
+        loaded_poll,
+        {"version": version, "last_week": last_week},
+        [{"label": i, "value": i} for i in bl.commodity_list(current)],
+        future1 or DEFAULT_FUTURE,
+        first_week,
+        last_week,
+        slider_weeks(net_week, shown, first_week, last_week),
+        first_week,
+        last_week,
+        slider_weeks(all_week, shown, first_week, last_week),
+    ]
 
-    arr = df1["commodity"].unique()
-    asset = arr[0]
 
-    fig = sf.make_sentiment_chart(df1, asset)
-    return fig
+####################################################
+#  Callbacks - charts
+####################################################
+# Figures are cached per chart, commodity, slider range and data version
+# The data version changes whenever fresh reports are loaded
+figure_cache = fc.FigureCache(maxsize=sf.figure_cache_size)
 
+# Pre-serialized figures for the most viewed markets, filled at start up
+figure_store = fc.FigureStore()
 
-@app.callback(
-    dash.dependencies.Output("da_sent", "figure"),
-    [dash.dependencies.Input("future", "value")],
-)
-def all_positions_da(future1):
-    df1 = bl.df_da[bl.df_da["Exchange"] == future1]
-    df1.set_index("Date", inplace=True)
 
-    arr = df1["commodity"].unique()
-    asset = arr[0]
+# version is the data_version of the snapshot the figure is built from
+def cached_figure(chart, future1, weeks, build, version):
+    key = (chart, future1, weeks, version)
+    fig = figure_store.get(key)
+    if fig is not None:
+        return fig
+    return figure_cache.get(key, build)
 
-    fig = sf.make_chart_DA(df1, asset, "Contracts")
-    return fig
 
+# Charts that take the rolling overlays
+overlay_charts = ["deacot_sent", "da_pos_all"]
 
-# Positions Charts
-@app.callback(
-    dash.dependencies.Output("da_pos_all", "figure"),
-    [dash.dependencies.Input("future", "value")],
-)
-def net_positions_actual_da(future1):
-    df1 = bl.df_da[bl.df_da["Exchange"] == future1]
-    df1.set_index("Date", inplace=True)
 
-    arr = df1["commodity"].unique()
-    asset = arr[0]
+# Builders for the charts that only depend on the commodity (and overlays)
+# Keyed by the id of the graph they feed, all built from the current snapshot
+def chart_builders(future1, overlays=(), window=None, current=None):
+    df_deacot, df1, asset = bl.commodity_view(future1, current)
 
-    fig = sf.make_net_DA_pos(df1, asset, "Contracts")
-    return fig
+    def rolling(report_name):
+        return bl.get_rolling(report_name, future1, current) if overlays else None
+
+    return {
+        # Sentiment charts
+        "deacot_sent": lambda: sf.make_sentiment_chart(
+            df_deacot, asset, rolling("deacot"), overlays, window
+        ),
+        "da_sent": lambda: sf.make_chart_DA(df1, asset, "Contracts"),
+        # Positions Charts
+        "da_pos_all": lambda: sf.make_net_DA_pos(
+            df1, asset, "Contracts", rolling("da"), overlays, window
+        ),
+        "da_pos_pct": lambda: sf.make_net_DA(df1, asset, "Contracts"),
+        # Week-over-week diffs in positions charts
+        "da_diff_all": lambda: sf.make_diff_barchart_DA_actual(
+            df1.iloc[-2:], asset, "Contracts"
+        ),
+        "da_diff_pct": lambda: sf.make_diff_barchart_DA(
+            df1.iloc[-2:], asset, "Contracts"
+        ),
+        # Total position breakdown chart
+        "da_bar": lambda: sf.make_barchart_DA(df1.iloc[-1:], asset, "Contracts"),
+    }
+
+
+# Builders for the 3d charts which also follow their range sliders
+def surface_builders(future1, first_week, last_week, current=None):
+    def weeks():
+        asset = bl.commodity_view(future1, current)[2]
 
+        # Rangeslider - just the rows between the selected slide ends
+        df1 = bl.get_da_weeks(future1, first_week, last_week, current)
+        return df1, asset
 
+    return {
+        "da_3d_net": lambda: sf.da_3d_surface(*weeks()),
+        "da_3d_all": lambda: sf.da_3d_surface_all(*weeks()),
+    }
+
+
+# Rangeslider - the full range is used until the slider reports a value
+def week_range(week, current=None):
+    if week is None:
+        return bl.week_bounds(current)
+    return (week[0], week[1])
+
+
+# Build and serialize the default view of the configured markets up front
+# so the first visitors to them don't pay for it
+def warm_figure_store():
+    current = bl.data
+    version = current["data_version"]
+    top = bl.top_exchanges(sf.warm_top_n, current)
+    exchanges = list(sf.warm_exchanges) + list(top)
+    first_week, last_week = week_range(None, current)
+    weeks = (first_week, last_week)
+
+    figure_store.clear()
+    for future1 in dict.fromkeys(exchanges):
+        if len(bl.get_da(future1, current)) == 0:
+            continue
+        for chart, build in chart_builders(future1, current=current).items():
+            figure_store.add((chart, future1, None, version), build())
+        surfaces = surface_builders(future1, first_week, last_week, current)
+        for chart, build in surfaces.items():
+            figure_store.add((chart, future1, weeks, version), build())
+    print(
+        "Pre-built figures for {0} markets ({1:,} bytes)".format(
+            len(figure_store.exchanges()), figure_store.nbytes()
+        )
+    )
+
+
+# Hit / miss counters for the figure cache
+@app.server.route("/cache-stats")
+def cache_stats():
+    stats = figure_cache.stats()
+    stats["store"] = figure_store.stats()
+    return flask.jsonify(stats)
+
+
+# Serve a pre-serialized figure as-is
+@app.server.route("/figure-store/<chart>/<path:exchange>")
+def stored_figure(chart, exchange):
+    raw = figure_store.get_bytes(chart, exchange, bl.data_version)
+    if raw is None:
+        flask.abort(404)
+    return flask.Response(raw, mimetype="application/json")
+
+
+# Every chart driven only by the commodity selection is built in one pass
+# The slice for the commodity is looked up once and shared by all of them
 @app.callback(
-    dash.dependencies.Output("da_pos_pct", "figure"),
+    [
+        dash.dependencies.Output("da_sent", "figure"),
+        dash.dependencies.Output("da_pos_pct", "figure"),
+        dash.dependencies.Output("da_diff_all", "figure"),
+        dash.dependencies.Output("da_diff_pct", "figure"),
+        dash.dependencies.Output("da_bar", "figure"),
+        dash.dependencies.Output("summary", "children"),
+    ],
     [dash.dependencies.Input("future", "value")],
 )
-def net_positions_pct_da(future1):
-    df1 = bl.df_da[bl.df_da["Exchange"] == future1]
-    df1.set_index("Date", inplace=True)
+def commodity_charts(future1):
+    # Nothing to show until the data has loaded
+    if not bl.ready.is_set() or not future1:
+        raise PreventUpdate
+
+    # One snapshot for every figure, in case a refresh lands part way through
+    current = bl.data
+    version = current["data_version"]
+    figures = [
+        cached_figure(chart, future1, None, build, version)
+        for chart, build in chart_builders(future1, current=current).items()
+        if chart not in overlay_charts
+    ]
+    df_deacot, df1, asset = bl.commodity_view(future1, current)
 
-    arr = df1["commodity"].unique()
-    asset = arr[0]
+    # Summary block
+    return figures + [dashboard_summary_numbers(df1)]
 
-    fig = sf.make_net_DA(df1, asset, "Contracts")
-    return fig
+
+# Charts with the rolling overlays - a callback of their own so toggling an
+# overlay only sends these two figures
+@app.callback(
+    [
+        dash.dependencies.Output("deacot_sent", "figure"),
+        dash.dependencies.Output("da_pos_all", "figure"),
+    ],
+    [
+        dash.dependencies.Input("future", "value"),
+        dash.dependencies.Input("overlays", "value"),
+        dash.dependencies.Input("overlay_window", "value"),
+    ],
+)
+def overlay_chart_figures(future1, overlays, window):
+    if not bl.ready.is_set() or not future1:
+        raise PreventUpdate
+
+    # The overlays are precomputed, so they only change the figures' cache
+    # key.  With none on, the key is the same as the pre-built figures'.
+    overlays = tuple(o for o in ["mean", "band", "change"] if o in (overlays or []))
+    overlay_key = (overlays, window) if overlays else None
+    current = bl.data
+    builders = chart_builders(future1, overlays, window, current)
+    return [
+        cached_figure(
+            chart, future1, overlay_key, builders[chart], current["data_version"]
+        )
+        for chart in overlay_charts
+    ]
 
 
 # 3d postiion chart
@@ -558,24 +1065,16 @@ def net_positions_pct_da(future1):
     ],
 )
 def da_3d_position_net(future1, week):
-    # Rangeslider - set initial values if none are set
-    if week is None:
-        first_week = bl.df_da["week_number"].min()
-        last_week = bl.df_da["week_number"].max()
-    else:
-        first_week = week[0]
-        last_week = week[1]
-
-    df1 = bl.df_da[bl.df_da["Exchange"] == future1]
+    # Nothing to show until the data has loaded
+    if not bl.ready.is_set() or not future1:
+        raise PreventUpdate
 
-    # Rangeslider - filter by the selected slide ends
-    df1 = df1[(df1["week_number"] >= first_week) & (df1["week_number"] <= last_week)]
-    df1.set_index("Date", inplace=True)
+    current = bl.data
+    first_week, last_week = week_range(week, current)
+    build = surface_builders(future1, first_week, last_week, current)["da_3d_net"]
 
-    arr = df1["commodity"].unique()
-    asset = arr[0]
-
-    fig = sf.da_3d_surface(df1, asset)
+    weeks = (first_week, last_week)
+    fig = cached_figure("da_3d_net", future1, weeks, build, current["data_version"])
     return fig
 
 
@@ -588,88 +1087,164 @@ def da_3d_position_net(future1, week):
     ],
 )
 def da_3d_position_all(future1, week):
-    # Rangeslider - set initial values if none are set
-    if week is None:
-        first_week = bl.df_da["week_number"].min()
-        last_week = bl.df_da["week_number"].max()
-    else:
-        first_week = week[0]
-        last_week = week[1]
+    # Nothing to show until the data has loaded
+    if not bl.ready.is_set() or not future1:
+        raise PreventUpdate
+
+    current = bl.data
+    first_week, last_week = week_range(week, current)
+    build = surface_builders(future1, first_week, last_week, current)["da_3d_all"]
 
-    df1 = bl.df_da[bl.df_da["Exchange"] == future1]
+    weeks = (first_week, last_week)
+    fig = cached_figure("da_3d_all", future1, weeks, build, current["data_version"])
+    return fig
 
-    # Rangeslider - filter by the selected slide ends
-    df1 = df1[(df1["week_number"] >= first_week) & (df1["week_number"] <= last_week)]
-    df1.set_index("Date", inplace=True)
 
-    arr = df1["commodity"].unique()
-    asset = arr[0]
+####################################################
+#  Callbacks - screener
+####################################################
+# Filled once the data is ready and again for a newer data set or class
+@app.callback(
+    [
+        Output("screener_table", "data"),
+        Output("screener_status", "children"),
+        Output("screener_poll", "interval"),
+        Output("screener_shown", "data"),
+    ],
+    [
+        Input("screener_class", "value"),
+        Input("screener_poll", "n_intervals"),
+    ],
+    State("screener_shown", "data"),
+)
+def screener_rows(class_name, n, shown):
+    if not bl.ready.is_set():
+        status = dbc.Alert(bl.status, color="info")
+        return [], status, loading_poll, dash.no_update
 
-    fig = sf.da_3d_surface_all(df1, asset)
-    return fig
+    current = bl.data
+    showing = {"version": current["data_version"], "class": class_name}
+    if shown == showing:
+        raise PreventUpdate
 
+    df = bl.screener_table(class_name, current)
+    df["Date"] = df["Date"].dt.strftime("%Y-%m-%d")
+    df = df.round({"net": 0, "cot_index": 1, "zscore": 2, "percentile": 1})
+    return df.to_dict("records"), None, loaded_poll, showing
 
-# Week-over-week diffs in positions charts
+
+####################################################
+#  Callbacks - comparison
+####################################################
+# The market list, filled once the data is ready and again for a newer data
+# set - a new version in compare_version redraws the figure
 @app.callback(
-    dash.dependencies.Output("da_diff_all", "figure"),
-    [dash.dependencies.Input("future", "value")],
+    [
+        Output("compare_futures", "options"),
+        Output("compare_status", "children"),
+        Output("compare_poll", "interval"),
+        Output("compare_version", "data"),
+    ],
+    Input("compare_poll", "n_intervals"),
+    State("compare_version", "data"),
 )
-def diff_position_actual_barchart_da(future1):
-    df1 = bl.df_da[bl.df_da["Exchange"] == future1]
-    df1.set_index("Date", inplace=True)
+def compare_loaded(n, shown):
+    if not bl.ready.is_set():
+        status = dbc.Alert(bl.status, color="info")
+        return dash.no_update, status, loading_poll, dash.no_update
 
-    arr = df1["commodity"].unique()
-    asset = arr[0]
-    df = df1.iloc[-2:]
+    current = bl.data
+    if shown == current["data_version"]:
+        raise PreventUpdate
+    options = [{"label": i, "value": i} for i in bl.commodity_list(current)]
+    return options, None, loaded_poll, current["data_version"]
 
-    fig = sf.make_diff_barchart_DA_actual(df, asset, "Contracts")
-    return fig
+
+# Every selected market in one figure, built from a single lookup
+@app.callback(
+    Output("compare_net", "figure"),
+    [
+        Input("compare_futures", "value"),
+        Input("compare_units", "value"),
+        Input("compare_version", "data"),
+    ],
+)
+def compare_net(futures, units, version):
+    if not bl.ready.is_set() or not futures:
+        raise PreventUpdate
+
+    futures = tuple(futures)
+    current = bl.data
+    build = lambda: sf.make_net_DA_compare(
+        bl.get_da_many(futures, current), futures, units
+    )
+    return cached_figure("compare_net", futures, units, build, current["data_version"])
 
 
+####################################################
+#  Callbacks - correlation
+####################################################
+# The market list, filled once the data is ready and again for a newer data
+# set - a new version in correlation_version redraws the heatmap
 @app.callback(
-    dash.dependencies.Output("da_diff_pct", "figure"),
-    [dash.dependencies.Input("future", "value")],
+    [
+        Output("correlation_futures", "options"),
+        Output("correlation_status", "children"),
+        Output("correlation_poll", "interval"),
+        Output("correlation_version", "data"),
+    ],
+    Input("correlation_poll", "n_intervals"),
+    State("correlation_version", "data"),
 )
-def diff_position_pct_barchart_da(future1):
-    df1 = bl.df_da[bl.df_da["Exchange"] == future1]
-    df1.set_index("Date", inplace=True)
+def correlation_loaded(n, shown):
+    if not bl.ready.is_set():
+        status = dbc.Alert(bl.status, color="info")
+        return dash.no_update, status, loading_poll, dash.no_update
 
-    arr = df1["commodity"].unique()
-    asset = arr[0]
-    df = df1.iloc[-2:]
-    fig = sf.make_diff_barchart_DA(df, asset, "Contracts")
-    return fig
+    current = bl.data
+    if shown == current["data_version"]:
+        raise PreventUpdate
+    options = [{"label": i, "value": i} for i in bl.commodity_list(current)]
+    return options, None, loaded_poll, current["data_version"]
 
 
-# Total position breakdown chart
 @app.callback(
-    dash.dependencies.Output("da_bar", "figure"),
-    [dash.dependencies.Input("future", "value")],
+    Output("correlation_heatmap", "figure"),
+    [
+        Input("correlation_class", "value"),
+        Input("correlation_weeks", "value"),
+        Input("correlation_values", "value"),
+        Input("correlation_futures", "value"),
+        Input("correlation_version", "data"),
+    ],
 )
-def total_position_barchart_da(future1):
-    df1 = bl.df_da[bl.df_da["Exchange"] == future1]
-    df1.set_index("Date", inplace=True)
+def correlation_heatmap(class_name, weeks, values, futures, version):
+    if not bl.ready.is_set() or not class_name or not weeks:
+        raise PreventUpdate
 
-    arr = df1["commodity"].unique()
-    asset = arr[0]
-    df = df1.iloc[-1:]
+    futures = tuple(futures or ())
+    current = bl.data
 
-    fig = sf.make_barchart_DA(df, asset, "Contracts")
-    return fig
+    def build():
+        names, matrix = bl.correlation_matrix(
+            class_name, weeks, values == "changes", futures, current
+        )
+        title = "{0} Net Position {1} - last {2} weeks (DA)".format(
+            sc.classes[class_name],
+            "Weekly Change Correlation" if values == "changes" else "Correlation",
+            weeks,
+        )
+        return sf.make_correlation_heatmap(names, matrix, title)
+
+    key = (weeks, values, futures)
+    version = current["data_version"]
+    return cached_figure("correlation", class_name, key, build, version)
 
 
 ###################################################
 # Summary Block
 ###################################################
-@app.callback(
-    dash.dependencies.Output("summary", "children"),
-    [dash.dependencies.Input("future", "value")],
-)
-def dashboard_summary_numbers(future1):
-    # Grab some values from the most recent DA datafame
-    df1 = bl.df_da[bl.df_da["Exchange"] == future1]
-    df1.set_index("Date", inplace=True)
-
+def dashboard_summary_numbers(df1):
     # I only care about the most recent row so pull it
     #  It makes reference easier further down.
     df = df1.iloc[-1:]
@@ -682,7 +1257,7 @@ def dashboard_summary_numbers(future1):
                     dbc.Alert(
                         [
                             html.H6("Latest Date: "),
-                            html.H6(df.index),
+                            html.H6(sf.report_date(df.index[0])),
                         ],
                         color="light",
                     ),
@@ -743,6 +1318,17 @@ def dashboard_summary_numbers(future1):
     )
 
 
+###################################################
+# Figure warm up
+###################################################
+# Runs each time new data is put in place, on the thread that put it there
+# (the loader, then the refresh loop), which waits for it to finish.  The
+# new data is already being served, so callbacks build whatever isn't
+# ready yet themselves.
+if sf.warm_figures:
+    bl.on_data_loaded(warm_figure_store)
+
+
 ###################################################
 # Server Run
 ###################################################
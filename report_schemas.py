@@ -0,0 +1,113 @@
+"""
+Report schemas for the CFTC files
+
+Each report maps the source column name to the name used throughout the
+dashboard and the dtype to read it as.  Only the columns listed here are
+read from the yearly files, so adding a column to a chart starts here.
+
+Positions are whole contract counts (int32), percentages are float32 and
+the market names repeat on every row so they are stored as categories.
+Dates are parsed once as they are read.
+"""
+
+###########################################
+# Legacy report (DEACOT)
+###########################################
+deacot = {
+    "Market and Exchange Names": ("Exchange", "category"),
+    "As of Date in Form YYYY-MM-DD": ("Date", "datetime64[ns]"),
+    "Open Interest (All)": ("Open_Interest", "int32"),
+    "Noncommercial Positions-Short (All)": ("Funds_Short_Positions", "int32"),
+    "Noncommercial Positions-Long (All)": ("Funds_Long_Positions", "int32"),
+    "Commercial Positions-Long (All)": ("Speculators_Long_Positions", "int32"),
+    "Commercial Positions-Short (All)": ("Speculators_Short_Positions", "int32"),
+    "Nonreportable Positions-Long (All)": ("NonReporting_Long_Positions", "int32"),
+    "Nonreportable Positions-Short (All)": ("NonReporting_Short_Positions", "int32"),
+    "% of OI-Noncommercial-Long (All)": ("funds_long_pct", "float32"),
+    "% of OI-Noncommercial-Short (All)": ("funds_short_pct", "float32"),
+    "% of OI-Commercial-Long (All)": ("dealers_long_pct", "float32"),
+    "% of OI-Commercial-Short (All)": ("dealers_short_pct", "float32"),
+    "% of OI-Nonreportable-Long (All)": ("nonreporting_long_pct", "float32"),
+    "% of OI-Nonreportable-Short (All)": ("nonreporting_short_pct", "float32"),
+}
+
+###########################################
+# Disaggregated report (DA)
+###########################################
+da = {
+    "Market_and_Exchange_Names": ("Exchange", "category"),
+    "Report_Date_as_YYYY-MM-DD": ("Date", "datetime64[ns]"),
+    "Open_Interest_All": ("Open_Interest", "int32"),
+    "Prod_Merc_Positions_Long_All": ("prod_long_all", "int32"),
+    "Prod_Merc_Positions_Short_All": ("prod_short_all", "int32"),
+    "Swap_Positions_Long_All": ("swap_long_all", "int32"),
+    "Swap__Positions_Short_All": ("swap_short_all", "int32"),
+    "Swap__Positions_Spread_All": ("swap_spread_all", "int32"),
+    "M_Money_Positions_Long_All": ("money_long_all", "int32"),
+    "M_Money_Positions_Short_All": ("money_short_all", "int32"),
+    "M_Money_Positions_Spread_All": ("money_spread_all", "int32"),
+    "Other_Rept_Positions_Long_All": ("other_long_all", "int32"),
+    "Other_Rept_Positions_Short_All": ("other_short_all", "int32"),
+    "Other_Rept_Positions_Spread_All": ("other_spread_all", "int32"),
+    "Tot_Rept_Positions_Long_All": ("total_report_long_all", "int32"),
+    "Tot_Rept_Positions_Short_All": ("total_report_short_all", "int32"),
+    "NonRept_Positions_Long_All": ("nonreport_long_all", "int32"),
+    "NonRept_Positions_Short_All": ("nonreport_short_all", "int32"),
+    "Pct_of_Open_Interest_All": ("open_interest_pct", "float32"),
+    "Pct_of_OI_Prod_Merc_Long_All": ("prod_long_pct", "float32"),
+    "Pct_of_OI_Prod_Merc_Short_All": ("prod_short_pct", "float32"),
+    "Pct_of_OI_Swap_Long_All": ("swap_long_pct", "float32"),
+    "Pct_of_OI_Swap_Short_All": ("swap_short_pct", "float32"),
+    "Pct_of_OI_Swap_Spread_All": ("swap_spread_pct", "float32"),
+    "Pct_of_OI_M_Money_Long_All": ("money_long_pct", "float32"),
+    "Pct_of_OI_M_Money_Short_All": ("money_short_pct", "float32"),
+    "Pct_of_OI_M_Money_Spread_All": ("money_spread_pct", "float32"),
+    "Pct_of_OI_Other_Rept_Long_All": ("other_long_pct", "float32"),
+    "Pct_of_OI_Other_Rept_Short_All": ("other_short_pct", "float32"),
+    "Pct_of_OI_Other_Rept_Spread_All": ("other_spread_pct", "float32"),
+    "Pct_of_OI_Tot_Rept_Long_All": ("total_report_long_pct", "float32"),
+    "Pct_of_OI_Tot_Rept_Short_All": ("total_report_short_pct", "float32"),
+    "Pct_of_OI_NonRept_Long_All": ("nonreport_long_pct", "float32"),
+    "Pct_of_OI_NonRept_Short_All": ("nonreport_short_pct", "float32"),
+}
+
+schemas = {
+    "deacot": deacot,
+    "da": da,
+}
+
+
+###########################################
+# Lookups
+###########################################
+# Source columns to read
+def usecols(report_name):
+    return list(schemas[report_name])
+
+
+# Source column -> dtype for the reader (dates are parsed separately)
+def dtypes(report_name):
+    return {
+        src: dtype
+        for src, (name, dtype) in schemas[report_name].items()
+        if not dtype.startswith("datetime")
+    }
+
+
+# Source columns to parse as dates
+def date_columns(report_name):
+    return [
+        src
+        for src, (name, dtype) in schemas[report_name].items()
+        if dtype.startswith("datetime")
+    ]
+
+
+# Source column -> dashboard column name
+def renames(report_name):
+    return {src: name for src, (name, dtype) in schemas[report_name].items()}
+
+
+# Source column for a dashboard column name
+def source_column(report_name, name):
+    return {name: src for src, name in renames(report_name).items()}[name]
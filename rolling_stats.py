@@ -0,0 +1,273 @@
+"""
+Rolling window statistics for the chart overlays
+
+For each Exchange and each charted series this works out, over the last
+4, 13, 26 and 52 reports (sf.rolling_windows):
+
+    mean        rolling mean
+    min / max   rolling low and high - the band around the series
+    change      change from the report a window ago
+
+The full history is done at load with whole-column NumPy and pandas
+operations.  The reports are sorted by Exchange, so each window is clipped
+to the start of its Exchange's rows rather than looping over markets.  The
+rolling min and max use the van Herk / Gil-Werman method: each Exchange's
+rows are cut into blocks one window long, and any window is then covered by
+the tail of one block and the head of the next.
+
+When a new week arrives only the new rows are worked out.  Each Exchange
+keeps a RollingWindow per series and window size, which takes a new value
+in O(1) (amortised for the min and max) with a running sum and monotonic
+deques.
+
+The statistics go in the data set as deacot_rolling and da_rolling, frames
+with the same rows as df_deacot and df_da, so a shared_data.py loader can
+publish them with the reports.  The running windows are kept alongside in
+rolling_states.
+"""
+from collections import deque
+import numpy as np
+import pandas as pd
+import support_functions as sf
+
+# Series each report gets overlays for
+series = {
+    "da": [c + "_net_all" for c in sf.da_net_classes],
+    "deacot": [
+        "funds_long_pct",
+        "funds_short_pct",
+        "dealers_long_pct",
+        "dealers_short_pct",
+        "nonreporting_long_pct",
+        "nonreporting_short_pct",
+    ],
+}
+
+stats = ["mean", "min", "max", "change"]
+
+
+column_name = sf.rolling_column
+
+
+# A fixed size window over a stream of values
+# NaN values take up a slot but are left out of the statistics
+class RollingWindow:
+    def __init__(self, size):
+        self.size = size
+        self.values = deque()
+        self.total = 0.0
+        self.count = 0
+        self.pushed = 0
+        # (position, value) pairs with rising values for the min and falling
+        # values for the max - the front is always the answer
+        self.lows = deque()
+        self.highs = deque()
+
+    # Add a value and return (mean, min, max, change) for the window
+    def push(self, value):
+        value = float(value)
+        oldest = np.nan
+        if len(self.values) == self.size:
+            oldest = self.values.popleft()
+            if oldest == oldest:
+                self.total -= oldest
+                self.count -= 1
+        self.values.append(value)
+        position = self.pushed
+        self.pushed += 1
+
+        if value == value:
+            self.total += value
+            self.count += 1
+            while self.lows and self.lows[-1][1] >= value:
+                self.lows.pop()
+            self.lows.append((position, value))
+            while self.highs and self.highs[-1][1] <= value:
+                self.highs.pop()
+            self.highs.append((position, value))
+        # Drop anything that has slid out of the window
+        first = self.pushed - self.size
+        while self.lows and self.lows[0][0] < first:
+            self.lows.popleft()
+        while self.highs and self.highs[0][0] < first:
+            self.highs.popleft()
+
+        if self.count == 0:
+            return np.nan, np.nan, np.nan, value - oldest
+        return (
+            self.total / self.count,
+            self.lows[0][1],
+            self.highs[0][1],
+            value - oldest,
+        )
+
+
+# Where each row's Exchange starts and the row's position within it
+# Rows must be sorted by Exchange
+def group_positions(codes):
+    n = len(codes)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    group_start = np.repeat(starts, np.diff(np.r_[starts, n]))
+    return group_start, np.arange(n) - group_start
+
+
+# Rolling low or high of every column, windows clipped to each Exchange
+def rolling_extreme(values, group_start, position, window, how):
+    n = len(values)
+    rows = np.arange(n)
+    fill = np.inf if how == "min" else -np.inf
+    values = np.where(np.isnan(values), fill, values)
+
+    # Blocks one window long, restarting with each Exchange
+    block = np.cumsum(position % window == 0)
+    head = pd.DataFrame(values).groupby(block)
+    tail = pd.DataFrame(values[::-1]).groupby(block[::-1])
+    if how == "min":
+        head, tail = head.cummin(), tail.cummin()
+    else:
+        head, tail = head.cummax(), tail.cummax()
+    head = head.to_numpy()
+    tail = tail.to_numpy()[::-1]
+
+    first = np.maximum(rows - window + 1, group_start)
+    combine = np.minimum if how == "min" else np.maximum
+    result = np.where(
+        (block[first] == block)[:, np.newaxis],
+        head,
+        combine(tail[first], head),
+    )
+    result[np.isinf(result)] = np.nan
+    return result
+
+
+# Rolling statistics for every series in df
+# df must be sorted by Exchange then Date - returns a float32 frame with the
+# same rows and index
+def compute(df, report_name, windows=None):
+    if windows is None:
+        windows = sf.rolling_windows
+    columns = series[report_name]
+    values = df[columns].to_numpy(dtype="float64")
+    group_start, position = group_positions(df["Exchange"].cat.codes.to_numpy())
+    rows = np.arange(len(df))
+
+    valid = ~np.isnan(values)
+    sums = np.vstack([np.zeros(len(columns)), np.cumsum(np.where(valid, values, 0), 0)])
+    counts = np.vstack([np.zeros(len(columns)), np.cumsum(valid, 0)])
+
+    results = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for window in windows:
+            first = np.maximum(rows - window + 1, group_start)
+            mean = (sums[rows + 1] - sums[first]) / (counts[rows + 1] - counts[first])
+            low = rolling_extreme(values, group_start, position, window, "min")
+            high = rolling_extreme(values, group_start, position, window, "max")
+            change = np.full(values.shape, np.nan)
+            back = position >= window
+            change[back] = values[back] - values[rows[back] - window]
+            for stat, result in zip(stats, [mean, low, high, change]):
+                for i, col in enumerate(columns):
+                    results[column_name(col, stat, window)] = result[:, i]
+    return pd.DataFrame(results, index=df.index, dtype="float32")
+
+
+# The running windows for an Exchange, primed with its existing rows
+def prime(report_name, values, windows):
+    state = {}
+    for window in windows:
+        for i, col in enumerate(series[report_name]):
+            rolling = RollingWindow(window)
+            for value in values[-window:, i]:
+                rolling.push(value)
+            state[(col, window)] = rolling
+    return state
+
+
+# Rolling statistics for a new data set, and the running windows for each
+# Exchange that has had a new week added
+# Rows added to the end of an Exchange in old_data are pushed through its
+# running windows.  Anything else means working out the full history again.
+def update(old_data, new_data, report_name):
+    df = new_data["df_" + report_name]
+    windows = list(sf.rolling_windows)
+    previous = old_data.get(report_name + "_rolling") if old_data else None
+    if (
+        previous is None
+        or old_data.get("rolling_windows") != windows
+        or old_data["exchange_codes"] != new_data["exchange_codes"]
+    ):
+        return compute(df, report_name, windows), {}
+
+    old_index = old_data[report_name + "_index"]
+    new_index = new_data[report_name + "_index"]
+    old_lengths = old_index[:, 1] - old_index[:, 0]
+    added = (new_index[:, 1] - new_index[:, 0]) - old_lengths
+    # Nothing added on the end means earlier rows were restated
+    if (added < 0).any() or not added.any():
+        return compute(df, report_name, windows), {}
+
+    old_df = old_data["df_" + report_name]
+    columns = series[report_name]
+    result_columns = list(previous.columns)
+    old_values = previous.to_numpy()
+    new_values = np.empty((len(df), len(result_columns)), dtype="float32")
+    # Data attached from a shared loader comes without the running windows,
+    # they are primed from the history when first needed
+    states = dict(old_data.get("rolling_states", {}).get(report_name, {}))
+    # Where each window's statistics go in a row of the frame
+    positions = {
+        (col, window): [
+            result_columns.index(column_name(col, stat, window)) for stat in stats
+        ]
+        for col in columns
+        for window in windows
+    }
+
+    for code in range(len(new_index)):
+        old_start, old_stop = old_index[code]
+        new_start, new_stop = new_index[code]
+        keep = old_stop - old_start
+        new_values[new_start : new_start + keep] = old_values[old_start:old_stop]
+        if not added[code]:
+            continue
+
+        if code not in states:
+            history = old_df[columns].iloc[old_start:old_stop]
+            states[code] = prime(report_name, history.to_numpy("float64"), windows)
+        # A copy of the windows so the old data set is left as it was
+        running = {key: copy_window(rolling) for key, rolling in states[code].items()}
+        states[code] = running
+        rows = df[columns].iloc[new_start + keep : new_stop].to_numpy(dtype="float64")
+        for row, values in enumerate(rows, start=new_start + keep):
+            for i, col in enumerate(columns):
+                for window in windows:
+                    key = (col, window)
+                    new_values[row, positions[key]] = running[key].push(values[i])
+
+    frame = pd.DataFrame(new_values, index=df.index, columns=result_columns)
+    return frame, states
+
+
+# Add the rolling statistics for both reports to a data set that doesn't
+# have them yet (one attached from a shared loader already does)
+# old_data is the data set it replaces, if any, so only new rows are worked out
+def add_rolling(new_data, old_data=None):
+    states = new_data.setdefault("rolling_states", {})
+    for report_name in series:
+        key = report_name + "_rolling"
+        if key not in new_data:
+            new_data[key], states[report_name] = update(
+                old_data, new_data, report_name
+            )
+            new_data["rolling_windows"] = list(sf.rolling_windows)
+
+
+def copy_window(rolling):
+    new = RollingWindow(rolling.size)
+    new.values = deque(rolling.values)
+    new.total = rolling.total
+    new.count = rolling.count
+    new.pushed = rolling.pushed
+    new.lows = deque(rolling.lows)
+    new.highs = deque(rolling.highs)
+    return new
@@ -0,0 +1,150 @@
+"""
+Cross-market screener
+
+Ranks every market in the DA report by how extreme each trader class's net
+position is against its own recent history:
+
+    cot_index   where the latest net sits between the window's low (0) and
+                high (100) - the usual COT Index
+    zscore      standard deviations from the window's mean
+    percentile  share of the window's weeks at or below the latest net
+
+The window is the last sf.screener_weeks report weeks (156 is three years).
+The net positions are laid out as one (week, market, class) array so each
+statistic is a single NumPy reduction over every market and class at once.
+When a new week arrives the window rolls forward by that week rather than
+being rebuilt from the whole report.
+"""
+import numpy as np
+import pandas as pd
+import support_functions as sf
+
+# Trader classes in the screener and their display names
+classes = {
+    "money": "Money Manager",
+    "prod": "Producer",
+    "swap": "Swap Dealer",
+    "other": "Other Reportable",
+    "nonreport": "Non-Reportable",
+}
+
+# Statistics worked out for each class
+stats = ["net", "cot_index", "zscore", "percentile"]
+
+
+class Screener:
+    def __init__(self, exchanges, dates, window, rows):
+        self.exchanges = exchanges
+        self.dates = dates
+        self.window = window
+        # Rows in the DA frame the window was built from
+        self.rows = rows
+        self.results = window_stats(window)
+
+    # Latest statistics for one class - a row per market with a report in
+    # the window, sorted by COT Index
+    def table(self, class_name):
+        i = list(classes).index(class_name)
+        latest_row = self.results["latest_row"][:, i]
+        df = pd.DataFrame(
+            {
+                "Exchange": np.asarray(self.exchanges),
+                "Date": self.dates[latest_row],
+                "Weeks": self.results["count"][:, i],
+            }
+        )
+        for stat in stats:
+            df[stat] = self.results[stat][:, i]
+        df = df[df["Weeks"] > 0]
+        return df.sort_values("cot_index", ascending=False, kind="mergesort")
+
+
+# Lay the net positions in df_da out as a (week, market, class) array over
+# dates, with markets in Exchange code order
+# Weeks a market didn't report are NaN
+def net_array(df_da, dates, markets):
+    values = df_da[[c + "_net_all" for c in classes]].to_numpy(dtype="float64")
+    week_rows = np.searchsorted(dates, df_da.index.to_numpy())
+    codes = df_da["Exchange"].cat.codes.to_numpy()
+    window = np.full((len(dates), markets, len(classes)), np.nan)
+    window[week_rows, codes] = values
+    return window
+
+
+# COT Index, z-score and percentile of the latest net position in the window
+# for every market and class at once
+def window_stats(window):
+    valid = ~np.isnan(window)
+    count = valid.sum(axis=0)
+
+    # The latest week each market reported in
+    latest_row = window.shape[0] - 1 - np.argmax(valid[::-1], axis=0)
+    latest = np.take_along_axis(window, latest_row[np.newaxis], axis=0)[0]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        low = np.where(valid, window, np.inf).min(axis=0)
+        high = np.where(valid, window, -np.inf).max(axis=0)
+        filled = np.where(valid, window, 0.0)
+        mean = filled.sum(axis=0) / count
+        deviation = np.where(valid, window - mean, 0.0)
+        std = np.sqrt((deviation**2).sum(axis=0) / (count - 1))
+
+        results = {
+            "count": count,
+            "latest_row": latest_row,
+            "net": np.where(count > 0, latest, np.nan),
+            "cot_index": 100 * (latest - low) / (high - low),
+            "zscore": (latest - mean) / std,
+            "percentile": 100 * (valid & (window <= latest)).sum(axis=0) / count,
+        }
+    # A flat window has no range or spread to measure against
+    for stat in ["cot_index", "zscore"]:
+        results[stat][~np.isfinite(results[stat])] = np.nan
+    return results
+
+
+# Build the screener from the full DA report
+def build(df_da, weeks=None):
+    if weeks is None:
+        weeks = sf.screener_weeks
+    exchanges = df_da["Exchange"].cat.categories
+    dates = np.unique(df_da.index.to_numpy())[-weeks:]
+    in_window = df_da.index >= dates[0]
+    window = net_array(df_da[in_window], dates, len(exchanges))
+    return Screener(exchanges, dates, window, len(df_da))
+
+
+# Bring a screener up to date with a new DA report
+# Weeks past the end of the window are rolled in and the oldest dropped.
+# Anything else (new markets, corrections to earlier weeks) means a rebuild.
+def update(screener, df_da, weeks=None):
+    if weeks is None:
+        weeks = sf.screener_weeks
+    if screener is None or not df_da["Exchange"].cat.categories.equals(
+        screener.exchanges
+    ):
+        return build(df_da, weeks)
+
+    newer = df_da.index > screener.dates[-1]
+    if len(df_da) - screener.rows != np.count_nonzero(newer):
+        return build(df_da, weeks)
+    if not newer.any():
+        return screener
+
+    new_rows = df_da[newer]
+    new_dates = np.unique(new_rows.index.to_numpy())
+    new_window = net_array(new_rows, new_dates, len(screener.exchanges))
+    return Screener(
+        screener.exchanges,
+        np.concatenate([screener.dates, new_dates])[-weeks:],
+        np.concatenate([screener.window, new_window])[-weeks:],
+        len(df_da),
+    )
+
+
+# Add the screener to a data set that doesn't have one yet (one attached from
+# a shared loader already does), rolled forward from old_data if there is one
+def add_screener(new_data, old_data=None):
+    if "screener" not in new_data:
+        previous = old_data.get("screener") if old_data else None
+        new_data["screener"] = update(previous, new_data["df_da"])
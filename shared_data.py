@@ -0,0 +1,313 @@
+"""
+    Shared memory data plane for running several dashboard workers
+
+    Normally every worker process (e.g. each gunicorn worker serving main.app)
+    downloads, parses and holds its own copy of the reports.  Running this
+    file instead starts a single loader that processes the reports once and
+    publishes the frames into shared memory.  Workers started with
+    shared_data = True in support_functions.py attach to those buffers
+    without copying them, so they start almost instantly and memory stays
+    flat as more workers are added.
+
+    Usage:
+        python shared_data.py          # leave running
+        gunicorn -w 4 main:server      # in another shell
+
+    The screener and the rolling statistics for the chart overlays are
+    worked out by the loader and published with the reports, so the
+    workers don't each work them out again.
+
+    Each column group is stored as one 2D block per dtype, laid out the way
+    pandas keeps its own blocks, so the frames can be rebuilt around the
+    shared buffers without a copy.  Text columns are published as category
+    codes with the categories kept in the manifest.  The manifest is a small
+    pickle in base_path naming the segments for the current data version.
+
+    The loader picks up each weekly release and publishes it as a new data
+    version.  Workers attach to it when they see they are behind.  The old
+    segments are unlinked straight away - workers already attached keep
+    their mappings until they swap the new version in and nothing is using
+    the old frames any more, then close them.
+"""
+import gc
+import hashlib
+import os
+import pickle
+import signal
+import time
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import pandas as pd
+import rolling_stats as rst
+import screener as sc
+import support_functions as sf
+
+# Segments this process has created or attached to, by data version
+# Each is kept with a weak reference to the array laid over it.  Every frame
+# built on the segment holds a view of that array, so once the reference is
+# dead nothing is using the segment and it can be closed.
+_segments = {}
+
+# Kept in the loader rather than published - the running windows behind the
+# rolling statistics are only needed to add the next week, and the views are
+# memoized by each worker
+local_keys = ["rolling_states", "views"]
+
+
+def manifest_path(name):
+    return sf.base_path + name + ".manifest"
+
+
+#############################################################################
+# Publishing
+#############################################################################
+# Copy a frame into shared memory - returns its description for the manifest
+def publish_frame(df, segment_prefix, segments):
+    # Group the columns into blocks: the index, plain columns by dtype and
+    # category codes by dtype
+    groups = {}
+    categoricals = {}
+    if df.index.name is not None:
+        index = df.index.to_numpy()
+        if index.dtype == object:
+            index = pd.Categorical(index)
+            categoricals[df.index.name] = (list(index.categories), index.ordered)
+            index = index.codes
+        groups[("index", index.dtype.str)] = [(df.index.name, index)]
+    for col in df.columns:
+        values = df[col]
+        kind = "values"
+        if values.dtype == object:
+            values = values.astype("category")
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            categoricals[col] = (list(values.cat.categories), values.cat.ordered)
+            values = values.cat.codes
+            kind = "codes"
+        groups.setdefault((kind, values.dtype.str), []).append(
+            (col, values.to_numpy())
+        )
+
+    blocks = []
+    for i, ((kind, dtype), columns) in enumerate(groups.items()):
+        shape = (len(columns), len(df))
+        nbytes = max(1, len(columns) * len(df) * np.dtype(dtype).itemsize)
+        shm = shared_memory.SharedMemory(
+            name=segment_prefix + "_" + str(i), create=True, size=nbytes
+        )
+        arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        segments.append((shm, weakref.ref(arr)))
+        for row, (col, values) in enumerate(columns):
+            arr[row] = values
+        blocks.append(
+            {
+                "segment": shm.name,
+                "kind": kind,
+                "dtype": dtype,
+                "columns": [col for col, values in columns],
+            }
+        )
+
+    return {
+        "rows": len(df),
+        "blocks": blocks,
+        "categoricals": categoricals,
+    }
+
+
+# Publish every frame in a data set from sf.load_reports
+# Everything that isn't a frame (indexes, screener, version) goes in the
+# manifest as is
+def publish(data, name):
+    # Kept short - macOS only allows 31 characters for a segment name
+    version = hashlib.sha1(data["data_version"].encode()).hexdigest()
+    segment_prefix = name + "_" + version[:8]
+    manifest = {"frames": {}, "extras": {}}
+    segments = _segments.setdefault(data["data_version"], [])
+    for key, value in data.items():
+        if key in local_keys:
+            continue
+        if isinstance(value, pd.DataFrame):
+            manifest["frames"][key] = publish_frame(
+                value, segment_prefix + "_" + str(len(manifest["frames"])), segments
+            )
+        else:
+            manifest["extras"][key] = value
+
+    # Swap the manifest in whole so workers never read half of one
+    tmp_file = manifest_path(name) + ".part"
+    with open(tmp_file, "wb") as f:
+        pickle.dump(manifest, f)
+    os.replace(tmp_file, manifest_path(name))
+    return manifest
+
+
+# Remove every segment named in a manifest
+def unlink(manifest):
+    for frame in manifest["frames"].values():
+        for block in frame["blocks"]:
+            try:
+                shm = shared_memory.SharedMemory(name=block["segment"])
+            except FileNotFoundError:
+                continue
+            shm.close()
+            shm.unlink()
+
+
+#############################################################################
+# Attaching
+#############################################################################
+def attach_segment(segment):
+    shm = shared_memory.SharedMemory(name=segment)
+    # Attaching registers the segment with this process' resource tracker,
+    # which would unlink it when the worker exits.  Only the loader owns it.
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+# Rebuild a frame around the shared buffers
+def attach_frame(frame, segments):
+    rows = frame["rows"]
+    index = None
+    values = []
+    categoricals = {}
+    for block in frame["blocks"]:
+        shm = attach_segment(block["segment"])
+        columns = block["columns"]
+        arr = np.ndarray((len(columns), rows), dtype=block["dtype"], buffer=shm.buf)
+        segments.append((shm, weakref.ref(arr)))
+        if block["kind"] == "index":
+            if columns[0] in frame["categoricals"]:
+                # Text index - rebuilt from its codes, which does make a copy
+                categories, ordered = frame["categoricals"][columns[0]]
+                index = pd.Index(categories, name=columns[0]).take(arr[0])
+            else:
+                index = pd.Index(arr[0], name=columns[0], copy=False)
+        elif block["kind"] == "codes":
+            for col, codes in zip(columns, arr):
+                categories, ordered = frame["categoricals"][col]
+                categoricals[col] = pd.Categorical.from_codes(
+                    codes, categories=categories, ordered=ordered
+                )
+        else:
+            values.append((columns, arr))
+
+    # The (columns, rows) block transposed is exactly how pandas lays out its
+    # own blocks, so the shared buffer becomes the frame's storage
+    parts = [
+        pd.DataFrame(arr.T, index=index, columns=columns, copy=False)
+        for columns, arr in values
+    ]
+    if categoricals:
+        parts.append(pd.DataFrame(categoricals, index=index))
+    return pd.concat(parts, axis=1, copy=False)
+
+
+def read_manifest(name):
+    try:
+        with open(manifest_path(name), "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+
+# Data version currently published under name, or None if nothing is
+# Cheap enough to check before deciding whether to attach
+def published_version(name):
+    manifest = read_manifest(name)
+    if manifest is None:
+        return None
+    return manifest["extras"]["data_version"]
+
+
+# Attach to the data published under name
+# Returns the data set in the same shape as sf.load_reports, or None if no
+# loader has published anything yet
+def attach(name):
+    manifest = read_manifest(name)
+    if manifest is None:
+        return None
+
+    version = manifest["extras"]["data_version"]
+    segments = []
+    try:
+        data = dict(manifest["extras"])
+        for key, frame in manifest["frames"].items():
+            data[key] = attach_frame(frame, segments)
+    except FileNotFoundError:
+        # The manifest outlived its loader
+        return None
+    finally:
+        _segments.setdefault(version, []).extend(segments)
+    return data
+
+
+# Close the segments of every data version other than keep
+# Segments still backing frames that something holds on to (a request that
+# was part way through when the data was swapped) are left for the next call
+def release(keep):
+    gc.collect()
+    for version in list(_segments):
+        if version == keep:
+            continue
+        still_open = []
+        for shm, arr in _segments[version]:
+            if arr() is None:
+                shm.close()
+            else:
+                still_open.append((shm, arr))
+        if still_open:
+            _segments[version] = still_open
+        else:
+            del _segments[version]
+
+
+#############################################################################
+# Loader
+#############################################################################
+# Work out what the workers would otherwise each work out for themselves
+# old_data is the data set being replaced, so only a new week is added
+def prepare(new_data, old_data=None):
+    sc.add_screener(new_data, old_data)
+    rst.add_rolling(new_data, old_data)
+    return new_data
+
+
+if __name__ == "__main__":
+    data = prepare(sf.load_reports())
+    manifest = publish(data, sf.shared_data_name)
+    print(
+        "Published data version "
+        + data["data_version"]
+        + " as "
+        + sf.shared_data_name
+        + " - leave this running while the dashboard workers use it"
+    )
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while True:
+            time.sleep(sf.refresh_wait() if sf.auto_refresh else 3600)
+            if not sf.auto_refresh or not sf.is_behind(data):
+                continue
+            new_data = sf.refresh_reports(data)
+            if new_data is None or new_data["data_version"] == data["data_version"]:
+                continue
+            old_manifest = manifest
+            data = prepare(new_data, data)
+            manifest = publish(data, sf.shared_data_name)
+            unlink(old_manifest)
+            release(data["data_version"])
+            print("Published data version " + data["data_version"])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        unlink(manifest)
+        if os.path.exists(manifest_path(sf.shared_data_name)):
+            os.remove(manifest_path(sf.shared_data_name))
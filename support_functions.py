@@ -7,15 +7,38 @@
     This file is called by both the main app as well as the business logic
 
 """
+import hashlib
 import zipfile
+import urllib.error
 import urllib.request
 import shutil
+import io
 import os
-from datetime import datetime, timedelta
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
 import pandas as pd
 import numpy as np
 import layout_configs as lc
+import report_schemas as rs
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+# pyarrow gives us the fast columnar (Feather) cache format
+# Without it the processed cache falls back to pickle files
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# zoneinfo (Python 3.9+) gives us the CFTC's local time for the release
+# schedule.  Without it Eastern Standard Time is assumed all year round.
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    ZoneInfo = None
 
 #############################################################################
 # Configuration - Change these to suit
@@ -23,6 +46,12 @@ import plotly.graph_objects as go
 # Path location
 base_path = "/tmp/"
 
+# Processed data is cached here so restarts skip re-parsing the reports
+cache_path = base_path + "processed/"
+
+# Bump this whenever the processing changes so old caches are rebuilt
+cache_schema_version = 7
+
 # Set a list of years to retrieve for analysis
 # Data is available from 2006 until current
 # *Note* Adding more years will considerably slow down the dashboard
@@ -33,14 +62,98 @@ analysis_years = [
 ]
 
 # Set the base URL for the CFTC repository - should not need to be changed
+# (point it at a local web server serving the zip files for testing)
 base_url = "https://www.cftc.gov/files/dea/history/"
 
+# Latest weekly release of each report, used for incremental updates
+weekly_urls = {
+    "deacot": "https://www.cftc.gov/dea/newcot/deafut.txt",
+    "da": "https://www.cftc.gov/dea/newcot/f_disagg.txt",
+}
+
+# Download settings
+# Number of report files to retrieve at the same time
+download_workers = 4
+# Number of attempts per file and the base wait (seconds) between attempts
+# The wait doubles after each failed attempt
+download_retries = 3
+download_backoff = 2
+# Seconds to wait on an unresponsive server before giving up on an attempt
+download_timeout = 60
+
+# Number of yearly files to read at the same time when aggregating
+read_workers = 4
+
+# Number of built chart figures to keep around for repeat requests
+figure_cache_size = 256
+
+# Share one copy of the processed data between dashboard worker processes
+# Run shared_data.py to load and publish it, then start the workers with
+# shared_data = True.  Workers fall back to loading their own copy if no
+# loader is running.
+shared_data = False
+shared_data_name = "cotdash"
+
+# Pre-build and serialize the default charts for these markets at start up
+# warm_top_n adds that many of the largest markets by open interest
+warm_figures = True
+warm_exchanges = [
+    "SILVER - COMMODITY EXCHANGE INC.",
+]
+warm_top_n = 0
+
+# Thin out the long line charts to at most this many points per trace
+# Largest-Triangle-Three-Buckets keeps the peaks and troughs so the shape
+# is unchanged at normal zoom.  0 sends every weekly point.
+line_max_points = 0
+
+# Number of report weeks the screener measures each market against
+screener_weeks = 156
+
+# Window lengths (in report weeks) offered on the correlation page, and the
+# fewest weeks two markets must share for their correlation to be shown
+correlation_windows = [13, 26, 52, 156]
+correlation_min_weeks = 8
+
+# Window lengths (in report weeks) offered for the rolling mean, band and
+# rate-of-change overlays on the net position and sentiment charts
+rolling_windows = [4, 13, 26, 52]
+
+# Longest wait (seconds) before trying again when the reports can't be
+# loaded - the wait starts at a minute and doubles after each failure
+load_retry = 1800
+
+# Level of detail for the 3D charts
+# Week ranges longer than surface_max_weeks are grouped into that many bins
+# before the surface is built so the browser can still rotate it smoothly.
+# surface_binning is "mean", "last" (the last week in each bin) or
+# "envelope" (the weeks each bin's lows and highs fell on, which keeps the
+# extremes visible).
+# Set surface_max_weeks = 0 to always draw every week.
+surface_max_weeks = 156
+surface_binning = "mean"
+
+# Release schedule - positions are as of Tuesday and the CFTC publishes them
+# the following Friday at 3:30pm Eastern (later after a federal holiday)
+release_timezone = "America/New_York"
+release_weekday = 4
+release_time = (15, 30)
+
+# Pick up each new release in the background without a restart
+# While a release is late, check again every refresh_retry seconds
+auto_refresh = True
+refresh_retry = 1800
+
+# Once a page has loaded the data it checks for a newer data set every
+# page_poll seconds, so sessions left open pick up each refresh
+page_poll = 300
+
 
 #############################################################################
 # Data Retreival and Handling
 #############################################################################
-# Function to retrieve reports
-def get_COT(url, file_name):
+# Download a url and hand back the raw bytes
+def fetch(url):
     req = urllib.request.Request(
         url, 
         data=None, 
@@ -49,98 +162,416 @@ def get_COT(url, file_name):
         }
     )
 
-    with urllib.request.urlopen(req) as response, open(file_name, "wb") as out_file:
-        shutil.copyfileobj(response, out_file)
+    with urllib.request.urlopen(req, timeout=download_timeout) as response:
+        return response.read()
+
+
+# Function to retrieve reports
+# The zip is held in memory and the single report member is streamed straight
+# into a uniquely named temp file next to file_path, which is then renamed
+# into place.  Readers never see a half written file and overlapping
+# refreshes can't trip over each other.
+# Returns the number of bytes downloaded so the caller can report on it
+def get_COT(url, file_path, member):
+    buffer = io.BytesIO(fetch(url))
+
+    with zipfile.ZipFile(buffer) as zf, zf.open(member) as src:
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(file_path) or ".",
+            prefix=os.path.basename(file_path) + ".",
+            suffix=".part",
+            delete=False,
+        ) as out_file:
+            try:
+                shutil.copyfileobj(src, out_file)
+            except BaseException:
+                out_file.close()
+                os.remove(out_file.name)
+                raise
+    # Temp files are created private - open it back up like a normal file
+    os.chmod(out_file.name, 0o644)
+    os.replace(out_file.name, file_path)
+
+    return buffer.getbuffer().nbytes
+
+
+# Call a download function with a retry and an exponential backoff between
+# attempts - the url is always the first argument
+# A 4xx response (e.g. a year the CFTC hasn't published) won't change on a
+# retry, so only network errors and 5xx responses are tried again
+def with_retry(func, url, *args):
+    for attempt in range(1, download_retries + 1):
+        try:
+            return func(url, *args)
+        except (urllib.error.URLError, zipfile.BadZipFile, OSError) as err:
+            client_error = isinstance(err, urllib.error.HTTPError) and err.code < 500
+            if client_error or attempt == download_retries:
+                raise
+            wait = download_backoff * 2 ** (attempt - 1)
+            print(
+                "Download of "
+                + url
+                + " failed ("
+                + str(err)
+                + ") - retrying in "
+                + str(wait)
+                + " seconds"
+            )
+            time.sleep(wait)
+
+
+#############################################################################
+# Release schedule
+#############################################################################
+def release_tz():
+    if ZoneInfo is not None:
+        try:
+            return ZoneInfo(release_timezone)
+        except Exception:
+            pass
+    return timezone(timedelta(hours=-5))
+
+
+# The most recent scheduled release at or before now
+def latest_release(now=None):
+    tz = release_tz()
+    now = datetime.now(tz) if now is None else now.astimezone(tz)
+    release = now.replace(
+        hour=release_time[0], minute=release_time[1], second=0, microsecond=0
+    )
+    release -= timedelta(days=(now.weekday() - release_weekday) % 7)
+    if release > now:
+        release -= timedelta(days=7)
+    return release
+
+
+def next_release(now=None):
+    return latest_release(now) + timedelta(days=7)
+
 
-    with zipfile.ZipFile(file_name) as zf:
-        zf.extractall()
+# The Tuesday the most recent release reports positions as of
+def latest_as_of(now=None):
+    release = latest_release(now)
+    return release.date() - timedelta(days=(release.weekday() - 1) % 7)
+
+
+# True once the newest year in analysis_years is over - no release after
+# that adds anything to the data
+def years_finished(now=None):
+    return latest_as_of(now).year > max(int(year) for year in analysis_years)
+
+
+# True when data is missing the most recent scheduled release
+# Never true for a finished year list, whose data is as current as it gets
+def is_behind(data, now=None):
+    if years_finished(now):
+        return False
+    return data["df_da"].index.max() < pd.Timestamp(latest_as_of(now))
+
+
+# Seconds to wait before checking for a release again
+def refresh_wait(now=None):
+    tz = release_tz()
+    now = datetime.now(tz) if now is None else now.astimezone(tz)
+    until_release = (next_release(now) - now).total_seconds()
+    return max(1, min(refresh_retry, until_release))
+
+
+# A yearly file is current if it was fetched after the latest release, or for
+# a year that has finished, after that year's last report came out
+def file_is_current(file_path, year, release):
+    filetime = datetime.fromtimestamp(os.path.getmtime(file_path), release.tzinfo)
+    if int(year) < release.year:
+        return filetime >= datetime(int(year) + 1, 1, 8, tzinfo=release.tzinfo)
+    return filetime >= release
 
 
 # Function to make sure things are fresh for data
-def process_reports(report, current_date, file_path, file_name, url_path):
+# Returns a summary dict for the file if a download happened, otherwise None
+def process_reports(report, year, release, file_path, url_path):
     if report == "Deacot":
         src_file = "annual.txt"
     else:
         src_file = "f_year.txt"
 
     if os.path.exists(file_path):
-        filetime = datetime.fromtimestamp(os.path.getctime(file_path))
-        if (filetime - timedelta(days=7)) <= current_date:
+        if file_is_current(file_path, year, release):
             print(report + " file exists and is current - using cached data")
-        else:
-            get_COT(
-                url_path,
-                file_name,
-            )
-            os.rename(src_file, file_path)
-            print(report + " file is stale - getting fresh copy")
+            return None
+        print(report + " file is stale - getting fresh copy")
     else:
         print(report + " file does not exist - getting fresh copy")
-        get_COT(
-            url_path,
-            file_name,
-        )
-        os.rename(src_file, file_path)
 
+    start = time.perf_counter()
+    size = with_retry(get_COT, url_path, file_path, src_file)
 
-def get_reports():
-    freshness_date = datetime.now() - timedelta(days=7)
-
-    # Loop through the years list for the deacot report
-    for i in analysis_years:
-        # Set up basic path constructs
-        url_path = base_url + "deacot" + i + ".zip"
-        file_name = "deacot" + i + ".zip"
-        file_path = base_path + "deacot" + i + ".txt"
+    return {
+        "file": file_path,
+        "bytes": size,
+        "seconds": time.perf_counter() - start,
+    }
 
-        process_reports("Deacot", freshness_date, file_path, file_name, url_path)
 
-    # Loop again for the DA report
-    for i in analysis_years:
-        url_path = base_url + "fut_disagg_txt_" + i + ".zip"
-        file_name = "fut_disagg_txt_" + i + ".zip"
-        file_path = base_path + "deacot_DA_" + i + ".txt"
+# Build the list of files to retrieve for each report and year
+def report_jobs(years):
+    jobs = []
+    for i in years:
+        # Set up basic path constructs
+        jobs.append(
+            (
+                "Deacot",
+                i,
+                base_path + "deacot" + i + ".txt",
+                base_url + "deacot" + i + ".zip",
+            )
+        )
+    for i in years:
+        jobs.append(
+            (
+                "DA",
+                i,
+                base_path + "deacot_DA_" + i + ".txt",
+                base_url + "fut_disagg_txt_" + i + ".zip",
+            )
+        )
+    return jobs
+
+
+# Retrieve all the reports, running up to download_workers downloads at once
+def get_reports(years=None, workers=None):
+    release = latest_release()
+    if years is None:
+        years = analysis_years
+    if workers is None:
+        workers = download_workers
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [
+            pool.submit(
+                process_reports,
+                report,
+                year,
+                release,
+                file_path,
+                url_path,
+            )
+            for report, year, file_path, url_path in report_jobs(years)
+        ]
+        summary = [f.result() for f in futures]
+    summary = [s for s in summary if s is not None]
 
-        process_reports("DA", freshness_date, file_path, file_name, url_path)
+    # Let the user know what was pulled down and how long it took
+    for s in summary:
+        print(
+            "Retrieved {file}: {bytes:,} bytes in {seconds:.2f} seconds".format(**s)
+        )
+    if summary:
+        print(
+            "Retrieved {0} files in {1:.2f} seconds".format(
+                len(summary), time.perf_counter() - start
+            )
+        )
+    return summary
 
 
-# function to aggregate all the reports into one dataframe for each report type
-def aggregate_reports(report_name):
+# List the yearly source files for a report
+def report_files(report_name, years=None):
     if report_name == "deacot":
         file_prefix = "deacot"
     else:
         file_prefix = "deacot_DA_"
-    df = pd.DataFrame()
-    for i in analysis_years:
-        file_path = base_path + file_prefix + i + ".txt"
-        df1 = pd.read_csv(file_path, na_values="x", low_memory=False)
-        df = df.append(
-            df1,
-            ignore_index=True,
+    if years is None:
+        years = analysis_years
+    return [base_path + file_prefix + i + ".txt" for i in years]
+
+
+# Report dates as shown to people - YYYY-MM-DD
+def report_date(value):
+    return pd.Timestamp(value).strftime("%Y-%m-%d")
+
+
+# Read a single yearly report file
+# Only the columns in the report schema are read, using their compact dtypes
+# names supplies the header for files that don't have one
+def read_report(file_path, report_name, names=None):
+    columns = rs.usecols(report_name)
+    dtypes = rs.dtypes(report_name)
+    options = {"parse_dates": rs.date_columns(report_name)}
+    if names is not None:
+        options.update(header=None, names=names)
+    try:
+        return pd.read_csv(
+            file_path,
+            na_values="x",
+            usecols=lambda col: col in columns,
+            dtype=dtypes,
+            **options
+        )
+    except ValueError:
+        # A position column with gaps can't be held as int32
+        # Fall back to float32 for the counts in this file
+        dtypes = {
+            col: "float32" if dtype == "int32" else dtype
+            for col, dtype in dtypes.items()
+        }
+        if hasattr(file_path, "seek"):
+            file_path.seek(0)
+        return pd.read_csv(
+            file_path,
+            na_values="x",
+            usecols=lambda col: col in columns,
+            dtype=dtypes,
+            **options
         )
+
+
+# Put columns that concat widened back to their compact dtypes
+# dtypes maps each column to the dtype it should have.  An integer column
+# that picked up gaps can't go back to int32, so it's held as float32.
+def restore_dtypes(df, dtypes):
+    for col, dtype in dtypes.items():
+        if col not in df:
+            continue
+        dtype = pd.api.types.pandas_dtype(dtype)
+        if isinstance(dtype, pd.CategoricalDtype):
+            # Each piece has its own set of categories so concat hands back
+            # objects
+            if not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype("category")
+        elif df[col].dtype != dtype:
+            if pd.api.types.is_integer_dtype(dtype) and df[col].isna().any():
+                dtype = "float32"
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+# Yield the reports one year at a time
+# Handy when only a few years are needed or the full set won't fit in memory
+def iter_reports(report_name, years=None):
+    for file_path in report_files(report_name, years):
+        yield read_report(file_path, report_name)
+
+
+# function to aggregate all the reports into one dataframe for each report type
+# All the years are read first (in parallel when workers > 1) and then joined
+# with a single concat rather than growing the frame one year at a time
+def aggregate_reports(report_name, years=None, workers=None):
+    if workers is None:
+        workers = read_workers
+    file_paths = report_files(report_name, years)
+    if workers > 1 and len(file_paths) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            frames = list(
+                pool.map(partial(read_report, report_name=report_name), file_paths)
+            )
+    else:
+        frames = [read_report(file_path, report_name) for file_path in file_paths]
+    df = pd.concat(frames, ignore_index=True)
+
+    # A year read with float32 counts (see read_report) widens the int32
+    # years to float64 in the concat, and each year has its own categories
+    return restore_dtypes(df, rs.dtypes(report_name))
+
+
+#############################################################################
+# Processed data cache
+#############################################################################
+# Hash the source files (plus the cache schema version) into a single key
+# Any change to a yearly file, the year list or the processing gives a new key
+def report_key(report_name, years=None):
+    key = hashlib.sha1()
+    key.update((report_name + ":" + str(cache_schema_version)).encode())
+    for file_path in report_files(report_name, years):
+        key.update(os.path.basename(file_path).encode())
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                key.update(chunk)
+    return key.hexdigest()
+
+
+# Where the processed frame for a report and source key is cached
+def cache_file(report_name, key):
+    if pyarrow is not None:
+        return os.path.join(cache_path, report_name + "_" + key + ".feather")
+    return os.path.join(cache_path, report_name + "_" + key + ".pkl")
+
+
+# Read a processed frame from the cache - returns None if it isn't there
+def read_processed(file_path):
+    if not os.path.exists(file_path):
+        return None
+    if file_path.endswith(".feather"):
+        return pd.read_feather(file_path)
+    return pd.read_pickle(file_path)
+
+
+# Write a processed frame to the cache and clear out older copies
+def write_processed(df, report_name, file_path):
+    os.makedirs(cache_path, exist_ok=True)
+    tmp_file = file_path + ".part"
+    try:
+        if file_path.endswith(".feather"):
+            df.to_feather(tmp_file)
+        else:
+            df.to_pickle(tmp_file)
+    except Exception as err:
+        # Not being able to cache shouldn't stop the dashboard
+        print("Unable to cache processed " + report_name + " data: " + str(err))
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        return
+    os.replace(tmp_file, file_path)
+
+    for old_file in os.listdir(cache_path):
+        old_file = os.path.join(cache_path, old_file)
+        if os.path.basename(old_file).startswith(report_name + "_") and (
+            old_file != file_path
+        ):
+            os.remove(old_file)
+
+
+# Return the processed dataframe for a report along with its source key
+# Uses the cached copy when the source files haven't changed, otherwise
+# aggregates and processes the yearly files and caches the result
+def load_processed(report_name):
+    key = report_key(report_name)
+    df = read_processed(cache_file(report_name, key))
+    if df is not None:
+        print(report_name + " processed data is current - using cached data")
+        return df, key
+
+    print(report_name + " processed data is missing or stale - processing reports")
+    df = aggregate_reports(report_name)
+    if report_name == "deacot":
+        df = deacot_process(df)
+    else:
+        df = DA_process(df)
+    # Columnar formats want a plain index - nothing downstream relies on it
+    df = df.reset_index(drop=True)
+    write_processed(df, report_name, cache_file(report_name, key))
+    return df, key
+
+
+# Break the Exchange names out into commodity and market columns
+# Only the few hundred unique names are split, then mapped back onto every row
+# through the category codes, so both come out as categories as well
+def split_exchange(df):
+    exchange = df["Exchange"].astype("category")
+    row_codes = exchange.cat.codes.to_numpy()
+    parts = exchange.cat.categories.to_series().str.split(" - ", expand=True)
+    parts = parts.reindex(columns=[0, 1])
+    for col, part in [("commodity", parts[0]), ("market", parts[1])]:
+        codes, uniques = pd.factorize(part)
+        codes = np.where(row_codes >= 0, codes[row_codes], -1)
+        df[col] = pd.Categorical.from_codes(codes, categories=uniques)
     return df
 
 
 # Process raw reports (DEACOT)
 def deacot_process(df):
     df.rename(
-        {
-            "Market and Exchange Names": "Exchange",
-            "As of Date in Form YYYY-MM-DD": "Date",
-            "Open Interest (All)": "Open_Interest",
-            "Noncommercial Positions-Short (All)": "Funds_Short_Positions",
-            "Noncommercial Positions-Long (All)": "Funds_Long_Positions",
-            "Commercial Positions-Long (All)": "Speculators_Long_Positions",
-            "Commercial Positions-Short (All)": "Speculators_Short_Positions",
-            "Nonreportable Positions-Long (All)": "NonReporting_Long_Positions",
-            "Nonreportable Positions-Short (All)": "NonReporting_Short_Positions",
-            "% of OI-Noncommercial-Long (All)": "funds_long_pct",
-            "% of OI-Noncommercial-Short (All)": "funds_short_pct",
-            "% of OI-Commercial-Long (All)": "dealers_long_pct",
-            "% of OI-Commercial-Short (All)": "dealers_short_pct",
-            "% of OI-Nonreportable-Long (All)": "nonreporting_long_pct",
-            "% of OI-Nonreportable-Short (All)": "nonreporting_short_pct",
-        },
+        rs.renames("deacot"),
         axis=1,
         inplace=True,
     )
@@ -162,60 +593,95 @@ def deacot_process(df):
     df["dealers_balance"] = 1 - (df["dealers_long_pct"] + df["dealers_short_pct"])
     df["funds_balance"] = 1 - (df["funds_long_pct"] + df["funds_short_pct"])
     # break out the exchange and commodity into new columns
-    df["commodity"] = df["Exchange"].str.split(" - ", expand=True)[0]
-    df["market"] = df["Exchange"].str.split(" - ", expand=True)[1]
+    df = split_exchange(df)
     return df
 
 
-# Process raw reports (DEACOT)
-def DA_process(df):
+# Trader classes with both long and short positions in the DA report
+da_net_classes = ["prod", "swap", "money", "other", "nonreport"]
+
+# Legend name and colour for each class's net position
+# The colours are the template's first five, so each class keeps the colour
+# it gets by default in make_net_DA_pos
+da_net_names = {
+    "prod": ("Producer Net", "#636efa"),
+    "swap": ("Swap Net", "#ef553b"),
+    "money": ("Money Manager Net", "#00cc96"),
+    "other": ("Other Net", "#ab63fa"),
+    "nonreport": ("Non-Reporting Net", "#ffa15a"),
+}
+
+# Classes with spread positions
+da_spread_classes = ["swap", "money", "other"]
+
+# Columns whose week-over-week change feeds the diff bar charts
+da_wow_columns = [
+    col + "_" + units
+    for units in ["all", "pct"]
+    for col in (
+        [c + "_long" for c in ["prod", "swap", "money", "other", "total_report"]]
+        + ["nonreport_long"]
+        + [c + "_short" for c in ["prod", "swap", "money", "other", "total_report"]]
+        + ["nonreport_short"]
+        + [c + "_spread" for c in da_spread_classes]
+        + ["spread"]
+    )
+] + ["total_long_all", "total_short_all"]
+
+
+# Work out the derived DA columns once so the charts only have to slice
+#   <class>_net_all / _net_pct - long less short for each trader class
+#   spread_all / spread_pct - spread positions across the classes
+#   total_long_all / _pct, total_short_all / _pct - reporting plus
+#   non-reporting
+#   <column>_wow - change from the Exchange's previous report
+# previous holds the latest processed row for each Exchange when df only
+# has newly arrived rows, so their week-over-week changes line up
+def add_derived_columns(df, previous=None):
+    for c in da_net_classes:
+        df[c + "_net_all"] = df[c + "_long_all"] - df[c + "_short_all"]
+        df[c + "_net_pct"] = df[c + "_long_pct"] - df[c + "_short_pct"]
+    for units in ["all", "pct"]:
+        df["spread_" + units] = sum(
+            df[c + "_spread_" + units] for c in da_spread_classes
+        )
+        for side in ["long", "short"]:
+            df["total_" + side + "_" + units] = (
+                df["total_report_" + side + "_" + units]
+                + df["nonreport_" + side + "_" + units]
+            )
+
+    # Rows are in date order, so a diff within each Exchange is the change
+    # from its previous report
+    values = df[["Exchange"] + da_wow_columns]
+    if previous is not None:
+        values = pd.concat([previous[["Exchange"] + da_wow_columns], values])
+    changes = values.groupby("Exchange", observed=True, sort=False)[
+        da_wow_columns
+    ].diff()
+    changes = changes.iloc[len(values) - len(df) :].astype("float32")
+    for col in da_wow_columns:
+        df[col + "_wow"] = changes[col].to_numpy()
+    return df
+
+
+# Process raw reports (DA)
+# date_begin is the date week numbers count from - defaults to the earliest
+# date in df, but has to be passed in when processing a few new weeks
+def DA_process(df, date_begin=None, previous=None):
     df.rename(
-        {
-            "Market_and_Exchange_Names": "Exchange",
-            "Report_Date_as_YYYY-MM-DD": "Date",
-            "Open_Interest_All": "Open_Interest",
-            "Prod_Merc_Positions_Long_All": "prod_long_all",
-            "Prod_Merc_Positions_Short_All": "prod_short_all",
-            "Swap_Positions_Long_All": "swap_long_all",
-            "Swap__Positions_Short_All": "swap_short_all",
-            "Swap__Positions_Spread_All": "swap_spread_all",
-            "M_Money_Positions_Long_All": "money_long_all",
-            "M_Money_Positions_Short_All": "money_short_all",
-            "M_Money_Positions_Spread_All": "money_spread_all",
-            "Other_Rept_Positions_Long_All": "other_long_all",
-            "Other_Rept_Positions_Short_All": "other_short_all",
-            "Other_Rept_Positions_Spread_All": "other_spread_all",
-            "Tot_Rept_Positions_Long_All": "total_report_long_all",
-            "Tot_Rept_Positions_Short_All": "total_report_short_all",
-            "NonRept_Positions_Long_All": "nonreport_long_all",
-            "NonRept_Positions_Short_All": "nonreport_short_all",
-            "Pct_of_Open_Interest_All": "open_interest_pct",
-            "Pct_of_OI_Prod_Merc_Long_All": "prod_long_pct",
-            "Pct_of_OI_Prod_Merc_Short_All": "prod_short_pct",
-            "Pct_of_OI_Swap_Long_All": "swap_long_pct",
-            "Pct_of_OI_Swap_Short_All": "swap_short_pct",
-            "Pct_of_OI_Swap_Spread_All": "swap_spread_pct",
-            "Pct_of_OI_M_Money_Long_All": "money_long_pct",
-            "Pct_of_OI_M_Money_Short_All": "money_short_pct",
-            "Pct_of_OI_M_Money_Spread_All": "money_spread_pct",
-            "Pct_of_OI_Other_Rept_Long_All": "other_long_pct",
-            "Pct_of_OI_Other_Rept_Short_All": "other_short_pct",
-            "Pct_of_OI_Other_Rept_Spread_All": "other_spread_pct",
-            "Pct_of_OI_Tot_Rept_Long_All": "total_report_long_pct",
-            "Pct_of_OI_Tot_Rept_Short_All": "total_report_short_pct",
-            "Pct_of_OI_NonRept_Long_All": "nonreport_long_pct",
-            "Pct_of_OI_NonRept_Short_All": "nonreport_short_pct",
-        },
+        rs.renames("da"),
         axis=1,
         inplace=True,
     )
     df = df.sort_values("Date")
     # break out the exchange and commodity into new columns
-    df["commodity"] = df["Exchange"].str.split(" - ", expand=True)[0]
-    df["market"] = df["Exchange"].str.split(" - ", expand=True)[1]
+    df = split_exchange(df)
     # add columns to deal with date format for rangeslider
-    df["date_begin"] = df["Date"].min()
-    df["date_end"] = df["Date"].values.astype("datetime64[D]")
+    if date_begin is None:
+        date_begin = df["Date"].min()
+    df["date_begin"] = date_begin
+    df["date_end"] = df["Date"]
     # Use numpy function to set the week number based on Tuesday when reports
     # are released by the CFTC
     df["week_number"] = np.busday_count(
@@ -223,13 +689,369 @@ def DA_process(df):
         df["date_end"].values.astype("M8[D]"),
         weekmask="Tue",
     )
+    df = add_derived_columns(df, previous)
+
+    return df
+
+
+# Retrieve, process and index both reports
+# Returns everything business_logic serves from as a single data set
+def load_reports():
+    # Make sure we have data
+    # This will check to see if a file exists and if not gets one
+    #  This also checks the data freshness
+    get_reports()
+
+    # These come from the processed cache when the source files haven't changed
+    df_deacot, deacot_key = load_processed("deacot")
+    df_da, da_key = load_processed("da")
+
+    data = index_reports(df_deacot, df_da)
+    data["deacot_key"] = deacot_key
+    data["da_key"] = da_key
+    data["data_version"] = data_version(data)
+    return data
+
+
+# Changes whenever either report's source files or rows change
+# Anything caching results built from the data should include it
+# The row counts matter for weekly rows that aren't in a yearly file
+def data_version(data):
+    sizes = str(len(data["df_deacot"])) + "," + str(len(data["df_da"]))
+    rows = hashlib.sha1(sizes.encode()).hexdigest()
+    return data["deacot_key"][:10] + data["da_key"][:10] + rows[:4]
 
+
+#############################################################################
+# Incremental weekly updates
+#############################################################################
+# Process newly arrived raw rows the same way as the full reports
+def process_new_rows(report_name, df_new, df):
+    if report_name == "deacot":
+        return deacot_process(df_new)
+    # The latest row of each Exchange so week-over-week changes carry on
+    previous = df.sort_values("Date", kind="mergesort").groupby(
+        "Exchange", observed=True, sort=False
+    ).tail(1)
+    return DA_process(df_new, date_begin=df["date_begin"].iloc[0], previous=previous)
+
+
+# Join newly processed rows onto a processed report
+# The joined frame keeps df's dtypes, so a week read with float32 counts
+# doesn't widen the int32 columns to float64
+def append_processed(df, df_new):
+    dtypes = df.dtypes.to_dict()
+    df = pd.concat([df, df_new], ignore_index=True)
+    return restore_dtypes(df, dtypes)
+
+
+# Pull the latest weekly release for a report and append whatever isn't
+# already in the processed frame df (indexed by Date, as served)
+# Returns the updated processed frame, or None if nothing was new
+def update_report(report_name, df):
+    raw = with_retry(fetch, weekly_urls[report_name])
+
+    # The weekly files have no header row but their columns are in the same
+    # order as the yearly files, so borrow the header from the newest one
+    existing = [f for f in report_files(report_name) if os.path.exists(f)]
+    header_file = max(existing)
+    names = pd.read_csv(header_file, nrows=0).columns
+    weekly = read_report(io.BytesIO(raw), report_name, names=names)
+    exchange_col = rs.source_column(report_name, "Exchange")
+    date_col = rs.source_column(report_name, "Date")
+
+    # Weeks outside the years being analysed would leave a gap in the data
+    in_years = weekly[date_col].dt.year.astype(str).isin(analysis_years).to_numpy()
+    if not in_years.any():
+        print(report_name + " weekly report is outside the analysis years")
+        return None
+
+    # Only rows for an (Exchange, Date) we don't already have are new
+    df = df.reset_index()
+    dates = weekly.loc[in_years, date_col].unique()
+    known = df.loc[df["Date"].isin(dates), ["Exchange", "Date"]].astype(str)
+    incoming = weekly[[exchange_col, date_col]].astype(str)
+    incoming.columns = ["Exchange", "Date"]
+    is_new = in_years & ~pd.MultiIndex.from_frame(incoming).isin(
+        pd.MultiIndex.from_frame(known)
+    )
+    if not is_new.any():
+        print(report_name + " weekly report has nothing new")
+        return None
+
+    # Keep the yearly source file in step so a full reload agrees with us
+    year = max(report_date(d)[:4] for d in dates)
+    lines = [line for line in raw.decode().splitlines() if line.strip()]
+    if len(lines) == len(weekly):
+        file_path = report_files(report_name, [year])[0]
+        with open(file_path, "a") as f:
+            for line, new in zip(lines, is_new):
+                if new:
+                    f.write(line + "\n")
+
+    # Only the new rows go through processing
+    df_new = process_new_rows(report_name, weekly[is_new].copy(), df)
+    df = append_processed(df, df_new)
+    print(
+        "Added {0} new {1} rows for {2}".format(
+            len(df_new), report_name, ", ".join(report_date(d) for d in dates)
+        )
+    )
     return df
 
 
+# Bring a loaded data set up to date with the latest weekly reports
+# Returns a new data set, or None when neither report had anything new
+def update_reports(data):
+    # Only the reports carry over - everything worked out from them (the
+    # screener, rolling statistics and so on) is brought up to date from
+    # the old data set when the new one is put in place
+    new_data = {
+        key: data[key] for key in ["df_deacot", "deacot_key", "df_da", "da_key"]
+    }
+    updated = False
+    for report_name in ["deacot", "da"]:
+        df = update_report(report_name, data["df_" + report_name])
+        if df is None:
+            continue
+        updated = True
+
+        # Cache under the key of the updated source files so the next start
+        # picks this up rather than reprocessing everything
+        key = report_key(report_name)
+        write_processed(df, report_name, cache_file(report_name, key))
+        new_data[report_name + "_key"] = key
+        new_data["df_" + report_name] = df
+
+    if not updated:
+        return None
+    # A new market may have turned up, so both reports get re-coded
+    new_data.update(index_reports(new_data["df_deacot"], new_data["df_da"]))
+    new_data["data_version"] = data_version(new_data)
+    return new_data
+
+
+# Bring data up to date with the latest release
+# Appends the weekly reports, falling back to a full reload if that fails
+# Returns the new data set, or None if there was nothing new or no way to get it
+def refresh_reports(data):
+    try:
+        try:
+            return update_reports(data)
+        except Exception as err:
+            print("Weekly update failed (" + str(err) + ") - reloading reports")
+            return load_reports()
+    except Exception as err:
+        print("Unable to refresh report data: " + str(err))
+        return None
+
+
+# Sort a processed report by Exchange then Date, index it by Date and work out
+# the row range each Exchange occupies.  Callbacks slice with those offsets
+# instead of comparing every row of the Exchange column.
+# Exchange is re-coded onto the given categories so that a code means the
+# same market in both reports.  The index is an array of (start, stop) rows
+# by code - markets missing from the report get an empty range.
+def build_exchange_index(df, categories):
+    if "Date" not in df.columns:
+        df = df.reset_index()
+    df["Exchange"] = df["Exchange"].astype("category").cat.set_categories(categories)
+    df = df.sort_values(["Exchange", "Date"], kind="mergesort").set_index("Date")
+
+    # Rows without a name sort to the end with a code of -1
+    codes = df["Exchange"].cat.codes.to_numpy()
+    codes = codes[: np.count_nonzero(codes >= 0)]
+    all_codes = np.arange(len(categories))
+    index = np.column_stack(
+        [
+            np.searchsorted(codes, all_codes, side="left"),
+            np.searchsorted(codes, all_codes, side="right"),
+        ]
+    )
+    return df, index
+
+
+# Index both reports over one shared set of Exchange codes
+# exchange_codes maps each market name to its code
+def index_reports(df_deacot, df_da):
+    names = pd.concat(
+        [
+            df_deacot["Exchange"].astype("category").cat.categories.to_series(),
+            df_da["Exchange"].astype("category").cat.categories.to_series(),
+        ]
+    )
+    categories = pd.Index(np.sort(names.unique()))
+    df_deacot, deacot_index = build_exchange_index(df_deacot, categories)
+    df_da, da_index = build_exchange_index(df_da, categories)
+    return {
+        "df_deacot": df_deacot,
+        "deacot_index": deacot_index,
+        "df_da": df_da,
+        "da_index": da_index,
+        "exchange_codes": {name: code for code, name in enumerate(categories)},
+    }
+
+
 #############################################################################
 # Charts
 #############################################################################
+# Largest-Triangle-Three-Buckets downsampling
+# Returns the indices of the points to keep: the first and last, plus the
+# point from each bucket in between that makes the largest triangle with the
+# point kept before it and the average of the next bucket
+# Gaps (NaN) are left out of the averages and never kept over a real point.
+# A bucket that is all gaps keeps its first point so the line still breaks
+# there, and the triangles carry on from the last real point kept.
+def lttb_indices(x, y, threshold):
+    n = len(x)
+    if threshold < 3 or n <= threshold:
+        return np.arange(n)
+    # Plotly hands dates back as datetime objects
+    x = pd.Index(x)
+    if isinstance(x, pd.DatetimeIndex):
+        x = x.asi8
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+
+    # Buckets cover every point between the first and last
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    real = ~np.isnan(y)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        counts = np.add.reduceat(real.astype("int64"), edges)
+        next_x = np.add.reduceat(np.where(real, x, 0), edges) / counts
+        next_y = np.add.reduceat(np.where(real, y, 0), edges) / counts
+    # The last bucket is just the final point.  A bucket that is all gaps
+    # has no average, so the one before it looks further ahead.
+    next_x = pd.Series(next_x[1:]).bfill().tolist()
+    next_y = pd.Series(next_y[1:]).bfill().tolist()
+
+    # The buckets are only a few points each, so plain floats are quicker
+    # than numpy calls inside the loop
+    xs = x.tolist()
+    ys = y.tolist()
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0 if real[0] else None
+    for i in range(threshold - 2):
+        nx, ny = next_x[i], next_y[i]
+        ax, ay = (xs[a], ys[a]) if a is not None else (nx, ny)
+        # With nothing real behind or ahead to measure from, every real
+        # point makes the same (empty) triangle and the first one is kept
+        if ny != ny:
+            nx, ny = ax, ay
+        if ay != ay:
+            ax, ay, nx, ny = 0.0, 0.0, 0.0, 0.0
+        best, best_area = edges[i], -1.0
+        for j in range(edges[i], edges[i + 1]):
+            area = abs((ax - nx) * (ys[j] - ay) - (ax - xs[j]) * (ny - ay))
+            # A gap's area is NaN, which never compares greater
+            if area > best_area:
+                best, best_area = j, area
+        keep[i + 1] = best
+        if best_area >= 0:
+            a = best
+    return keep
+
+
+# Downsample every line trace in a figure longer than max_points
+def downsample_traces(fig, max_points=None):
+    if max_points is None:
+        max_points = line_max_points
+    if not max_points:
+        return fig
+    for trace in fig.data:
+        if trace.type != "scatter" or trace.x is None or len(trace.x) <= max_points:
+            continue
+        keep = lttb_indices(trace.x, trace.y, max_points)
+        trace.x = np.asarray(trace.x)[keep]
+        trace.y = np.asarray(trace.y)[keep]
+    return fig
+
+
+# Column rolling_stats.py keeps a statistic of col in
+def rolling_column(col, stat, window):
+    return col + "_" + stat + "_" + str(window)
+
+
+# Rolling overlays for the line charts
+# rolling holds the rolling_stats.py columns for the same rows as the chart
+# and series is (column, name, colour) for each line to overlay.  overlays
+# picks from "mean" (dotted line), "band" (shaded low to high range) and
+# "change" (change over the window, on its own axis on the right).
+def add_rolling_overlays(fig, rolling, series, overlays, window):
+    if rolling is None or not overlays:
+        return fig
+    label = " " + str(window) + "wk "
+    for col, name, color in series:
+        def stat(what):
+            return rolling[rolling_column(col, what, window)]
+
+        if "band" in overlays:
+            fig.add_traces(
+                go.Scatter(
+                    x=rolling.index,
+                    y=stat("min"),
+                    name=name + label + "Low",
+                    showlegend=False,
+                    mode="lines",
+                    line_width=0,
+                    line_color=color,
+                )
+            )
+            fig.add_traces(
+                go.Scatter(
+                    x=rolling.index,
+                    y=stat("max"),
+                    name=name + label + "High",
+                    showlegend=False,
+                    mode="lines",
+                    line_width=0,
+                    line_color=color,
+                    fill="tonexty",
+                    opacity=0.25,
+                )
+            )
+        if "mean" in overlays:
+            fig.add_traces(
+                go.Scatter(
+                    x=rolling.index,
+                    y=stat("mean"),
+                    name=name + label + "Mean",
+                    showlegend=False,
+                    mode="lines",
+                    line_width=1,
+                    line_dash="dot",
+                    line_color=color,
+                )
+            )
+        if "change" in overlays:
+            fig.add_traces(
+                go.Scatter(
+                    x=rolling.index,
+                    y=stat("change"),
+                    name=name + label + "Change",
+                    showlegend=False,
+                    mode="lines",
+                    line_width=1,
+                    line_dash="dashdot",
+                    line_color=color,
+                    yaxis="y2",
+                )
+            )
+    if "change" in overlays:
+        fig.update_layout(
+            yaxis2=dict(
+                title=str(window) + " Week Change",
+                overlaying="y",
+                side="right",
+                showgrid=False,
+                zeroline=False,
+            )
+        )
+    return fig
+
+
 # Create DEACOT position chart - not currently used
 def make_chart(df, commodity, units):
     fig = go.Figure(layout=lc.layout)
@@ -337,7 +1159,8 @@ def make_chart(df, commodity, units):
 
 
 # Create DEACOT sentiment chart
-def make_sentiment_chart(df, commodity):
+# rolling, overlays and window add the rolling_stats.py overlays
+def make_sentiment_chart(df, commodity, rolling=None, overlays=(), window=None):
     fig = go.Figure(layout=lc.layout_simple)
     fig.add_traces(
         go.Scatter(
@@ -418,8 +1241,22 @@ def make_sentiment_chart(df, commodity):
         xaxis_title="",
         yaxis_title="Percent",
     )
+    add_rolling_overlays(
+        fig,
+        rolling,
+        [
+            ("funds_long_pct", "Funds Long", "fuchsia"),
+            ("funds_short_pct", "Funds Short", "fuchsia"),
+            ("dealers_long_pct", "Spec. Long", "silver"),
+            ("dealers_short_pct", "Spec. Short", "silver"),
+            ("nonreporting_long_pct", "NonRep Long", "aqua"),
+            ("nonreporting_short_pct", "NonRep Short", "aqua"),
+        ],
+        overlays,
+        window,
+    )
     # fig.show(config=lc.tool_config)
-    return fig
+    return downsample_traces(fig)
 
 
 # Create DA position chart
@@ -438,7 +1275,7 @@ def make_chart_DA(df, commodity, units):
     fig.add_traces(
         go.Scatter(
             x=df.index,
-            y=df.total_report_long_all + df.nonreport_long_all,
+            y=df.total_long_all,
             name="Total Long",
             line_width=2,
         )
@@ -446,7 +1283,7 @@ def make_chart_DA(df, commodity, units):
     fig.add_traces(
         go.Scatter(
             x=df.index,
-            y=df.total_report_short_all + df.nonreport_short_all,
+            y=df.total_short_all,
             name="Total Short",
             line_width=2,
         )
@@ -590,7 +1427,7 @@ def make_chart_DA(df, commodity, units):
         yaxis_title=units,
     )
     # fig.show(config=lc.tool_config)
-    return fig
+    return downsample_traces(fig)
 
 
 # Create DA barchart for current week positions
@@ -627,7 +1464,7 @@ def make_barchart_DA(df, commodity, spare):
         df.iloc[0]["other_long_pct"],
         df.iloc[0]["total_report_long_pct"],
         df.iloc[0]["nonreport_long_pct"],
-        df.iloc[0]["total_report_long_pct"] + df.iloc[0]["nonreport_long_pct"],
+        df.iloc[0]["total_long_pct"],
     ]
     shorts = [
         df.iloc[0]["prod_short_pct"],
@@ -636,15 +1473,13 @@ def make_barchart_DA(df, commodity, spare):
         df.iloc[0]["other_short_pct"],
         df.iloc[0]["total_report_short_pct"],
         df.iloc[0]["nonreport_short_pct"],
-        df.iloc[0]["total_report_short_pct"] + df.iloc[0]["nonreport_short_pct"],
+        df.iloc[0]["total_short_pct"],
     ]
     spreads = [
         df.iloc[0]["swap_spread_pct"],
         df.iloc[0]["money_spread_pct"],
         df.iloc[0]["other_spread_pct"],
-        df.iloc[0]["swap_spread_pct"]
-        + df.iloc[0]["money_spread_pct"]
-        + df.iloc[0]["other_spread_pct"],
+        df.iloc[0]["spread_pct"],
     ]
 
     fig = go.Figure(
@@ -674,13 +1509,18 @@ def make_barchart_DA(df, commodity, spare):
     )
 
     fig.update_traces(
-        marker_line_width=1, marker_line_color="rgb(192, 192, 192)", opacity=1
+        marker_line_width=1,
+        marker_line_color="rgb(192, 192, 192)",
+        opacity=1,
+        texttemplate="%{text:.1f}",
     )
 
     fig.update_layout(
         barmode="group",
         newshape=dict(line_color="yellow"),
-        title=commodity + " Disaggregated Report Positions (DA): " + df.index[0],
+        title=commodity
+        + " Disaggregated Report Positions (DA): "
+        + report_date(df.index[0]),
         xaxis_title="",
         yaxis_title="percent",
     )
@@ -688,8 +1528,27 @@ def make_barchart_DA(df, commodity, spare):
     return fig
 
 
+# Placeholder for a chart there isn't enough data to draw yet
+def make_empty_chart(title, message="Not enough reports yet"):
+    fig = go.Figure(layout=dict(template="plotly_dark"))
+    fig.update_layout(
+        title=title,
+        xaxis=dict(visible=False),
+        yaxis=dict(visible=False),
+        annotations=[dict(text=message, showarrow=False, font=dict(size=16))],
+    )
+    return fig
+
+
 # Create DA diff barchart for last two weeks (pct)
+# A market with a single report has no week-over-week change to show
 def make_diff_barchart_DA(df, commodity, spare):
+    if len(df) < 2:
+        return make_empty_chart(
+            commodity
+            + " Disaggregated Report Positions Percentage"
+            + "<br>(week-over-week change) (DA)"
+        )
     class_long = [
         "producer",
         "swap",
@@ -714,35 +1573,26 @@ def make_diff_barchart_DA(df, commodity, spare):
     ]
 
     longs = [
-        df.iloc[1]["prod_long_pct"] - df.iloc[0]["prod_long_pct"],
-        df.iloc[1]["swap_long_pct"] - df.iloc[0]["swap_long_pct"],
-        df.iloc[1]["money_long_pct"] - df.iloc[0]["money_long_pct"],
-        df.iloc[1]["other_long_pct"] - df.iloc[0]["other_long_pct"],
-        df.iloc[1]["total_report_long_pct"] - df.iloc[0]["total_report_long_pct"],
-        df.iloc[1]["nonreport_long_pct"] - df.iloc[0]["nonreport_long_pct"],
+        df.iloc[-1]["prod_long_pct_wow"],
+        df.iloc[-1]["swap_long_pct_wow"],
+        df.iloc[-1]["money_long_pct_wow"],
+        df.iloc[-1]["other_long_pct_wow"],
+        df.iloc[-1]["total_report_long_pct_wow"],
+        df.iloc[-1]["nonreport_long_pct_wow"],
     ]
     shorts = [
-        df.iloc[1]["prod_short_pct"] - df.iloc[0]["prod_short_pct"],
-        df.iloc[1]["swap_short_pct"] - df.iloc[0]["swap_short_pct"],
-        df.iloc[1]["money_short_pct"] - df.iloc[0]["money_short_pct"],
-        df.iloc[1]["other_short_pct"] - df.iloc[0]["other_short_pct"],
-        df.iloc[1]["total_report_short_pct"] - df.iloc[0]["total_report_short_pct"],
-        df.iloc[1]["nonreport_short_pct"] - df.iloc[0]["nonreport_short_pct"],
+        df.iloc[-1]["prod_short_pct_wow"],
+        df.iloc[-1]["swap_short_pct_wow"],
+        df.iloc[-1]["money_short_pct_wow"],
+        df.iloc[-1]["other_short_pct_wow"],
+        df.iloc[-1]["total_report_short_pct_wow"],
+        df.iloc[-1]["nonreport_short_pct_wow"],
     ]
     spreads = [
-        df.iloc[1]["swap_spread_pct"] - df.iloc[0]["swap_spread_pct"],
-        df.iloc[1]["money_spread_pct"] - df.iloc[0]["money_spread_pct"],
-        df.iloc[1]["other_spread_pct"] - df.iloc[0]["other_spread_pct"],
-        (
-            df.iloc[1]["swap_spread_pct"]
-            + df.iloc[1]["money_spread_pct"]
-            + df.iloc[1]["other_spread_pct"]
-            - (
-                df.iloc[0]["swap_spread_pct"]
-                + df.iloc[0]["money_spread_pct"]
-                + df.iloc[0]["other_spread_pct"]
-            )
-        ),
+        df.iloc[-1]["swap_spread_pct_wow"],
+        df.iloc[-1]["money_spread_pct_wow"],
+        df.iloc[-1]["other_spread_pct_wow"],
+        df.iloc[-1]["spread_pct_wow"],
     ]
 
     fig = go.Figure(
@@ -783,9 +1633,9 @@ def make_diff_barchart_DA(df, commodity, spare):
         newshape=dict(line_color="yellow"),
         title=commodity
         + " Disaggregated Report Positions Percentage<br>(week-over-week change) (DA): "
-        + df.index[1]
+        + report_date(df.index[1])
         + " - "
-        + df.index[0],
+        + report_date(df.index[0]),
         xaxis_title="",
         yaxis_title="percent",
     )
@@ -800,7 +1650,7 @@ def make_net_DA(df, commodity, units):
     fig.add_traces(
         go.Scatter(
             x=df.index,
-            y=df["prod_long_pct"] - df["prod_short_pct"],
+            y=df["prod_net_pct"],
             name="Producer Net",
             # visible="legendonly",
             line_width=2,
@@ -810,7 +1660,7 @@ def make_net_DA(df, commodity, units):
     fig.add_traces(
         go.Scatter(
             x=df.index,
-            y=df["swap_long_pct"] - df["swap_short_pct"],
+            y=df["swap_net_pct"],
             name="Swap Net",
             # visible="legendonly",
             line_width=2,
@@ -820,7 +1670,7 @@ def make_net_DA(df, commodity, units):
     fig.add_traces(
         go.Scatter(
             x=df.index,
-            y=df["money_long_pct"] - df["money_short_pct"],
+            y=df["money_net_pct"],
             name="Money Manager Net",
             # visible="legendonly",
             line_width=2,
@@ -830,7 +1680,7 @@ def make_net_DA(df, commodity, units):
     fig.add_traces(
         go.Scatter(
             x=df.index,
-            y=df["other_long_pct"] - df["other_short_pct"],
+            y=df["other_net_pct"],
             name="Other Net",
             # visible="legendonly",
             line_width=2,
@@ -840,7 +1690,7 @@ def make_net_DA(df, commodity, units):
     fig.add_traces(
         go.Scatter(
             x=df.index,
-            y=df["nonreport_long_pct"] - df["nonreport_short_pct"],
+            y=df["nonreport_net_pct"],
             name="Non-Reporting Net",
             line_width=2,
             fill="tozeroy",
@@ -855,17 +1705,18 @@ def make_net_DA(df, commodity, units):
         yaxis_title="Net Percent Participation",
     )
     # fig.show(config=lc.tool_config)
-    return fig
+    return downsample_traces(fig)
 
 
 # Create DA net position chart (contracts)
-def make_net_DA_pos(df, commodity, units):
+# rolling, overlays and window add the rolling_stats.py overlays
+def make_net_DA_pos(df, commodity, units, rolling=None, overlays=(), window=None):
     fig = go.Figure(layout=lc.layout_simple)
 
     fig.add_traces(
         go.Scatter(
             x=df.index,
-            y=df["prod_long_all"] - df["prod_short_all"],
+            y=df["prod_net_all"],
             name="Producer Net",
             # visible="legendonly",
             line_width=2,
@@ -875,7 +1726,7 @@ def make_net_DA_pos(df, commodity, units):
     fig.add_traces(
         go.Scatter(
             x=df.index,
-            y=df["swap_long_all"] - df["swap_short_all"],
+            y=df["swap_net_all"],
             name="Swap Net",
             # visible="legendonly",
             line_width=2,
@@ -885,7 +1736,7 @@ def make_net_DA_pos(df, commodity, units):
     fig.add_traces(
         go.Scatter(
             x=df.index,
-            y=df["money_long_all"] - df["money_short_all"],
+            y=df["money_net_all"],
             name="Money Manager Net",
             # visible="legendonly",
             line_width=2,
@@ -895,7 +1746,7 @@ def make_net_DA_pos(df, commodity, units):
     fig.add_traces(
         go.Scatter(
             x=df.index,
-            y=df["other_long_all"] - df["other_short_all"],
+            y=df["other_net_all"],
             name="Other Net",
             # visible="legendonly",
             line_width=2,
@@ -905,7 +1756,7 @@ def make_net_DA_pos(df, commodity, units):
     fig.add_traces(
         go.Scatter(
             x=df.index,
-            y=df["nonreport_long_all"] - df["nonreport_short_all"],
+            y=df["nonreport_net_all"],
             name="Non-Reporting Net",
             line_width=2,
             fill="tozeroy",
@@ -919,12 +1770,107 @@ def make_net_DA_pos(df, commodity, units):
         xaxis_title="",
         yaxis_title="Net Orders",
     )
+    add_rolling_overlays(
+        fig,
+        rolling,
+        [(c + "_net_all",) + da_net_names[c] for c in da_net_classes],
+        overlays,
+        window,
+    )
     # fig.show(config=lc.tool_config)
+    return downsample_traces(fig)
+
+
+# Net positions for several markets, one panel each on a shared date axis
+# df holds the DA rows for all of them.  The net columns are pivoted to
+# Date x Exchange in one go so every market lines up on the same dates.
+def make_net_DA_compare(df, exchanges, units):
+    suffix = "_net_pct" if units == "pct" else "_net_all"
+    columns = [c + suffix for c in da_net_classes]
+    present = set(df["Exchange"].unique())
+    exchanges = [e for e in exchanges if e in present]
+
+    wide = df.pivot(columns="Exchange", values=columns)
+
+    fig = make_subplots(
+        rows=max(1, len(exchanges)),
+        cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.04,
+        subplot_titles=[e.split(" - ")[0] for e in exchanges],
+    )
+    for row, exchange in enumerate(exchanges, start=1):
+        for c, col in zip(da_net_classes, columns):
+            # Same colour in every panel so a class is easy to follow
+            name, color = da_net_names[c]
+            fig.add_trace(
+                go.Scatter(
+                    x=wide.index,
+                    y=wide[(col, exchange)],
+                    name=name,
+                    legendgroup=c,
+                    showlegend=row == 1,
+                    line_width=2,
+                    line_color=color,
+                    fill="tozeroy",
+                ),
+                row=row,
+                col=1,
+            )
+        fig.add_hline(y=0, line_width=1, line_color="white", row=row, col=1)
+
+    fig.update_layout(
+        template=lc.layout_simple.template,
+        hovermode="x",
+        newshape=dict(line_color="yellow"),
+        height=max(1, len(exchanges)) * 300,
+        title="Disaggregated Report "
+        + ("Net Percent Positions" if units == "pct" else "Net Positions")
+        + " (DA)",
+    )
+    return downsample_traces(fig)
+
+
+# Heatmap of a correlation matrix from correlation.py
+# The axes are labelled with the commodity names, the hover has the markets
+# in full.  Past 80 markets the labels are left off as they can't be read.
+def make_correlation_heatmap(names, matrix, title):
+    short = [name.split(" - ")[0] for name in names]
+    fig = go.Figure(
+        go.Heatmap(
+            z=matrix,
+            x=names,
+            y=names,
+            zmin=-1,
+            zmax=1,
+            colorscale="RdBu_r",
+            hovertemplate="%{y}<br>%{x}<br>Correlation %{z:.2f}<extra></extra>",
+        ),
+        layout=dict(template="plotly_dark"),
+    )
+    show_labels = len(names) <= 80
+    axis = dict(
+        tickmode="array",
+        tickvals=names,
+        ticktext=short,
+        showticklabels=show_labels,
+        showgrid=False,
+    )
+    fig.update_layout(
+        title=title,
+        xaxis=axis,
+        yaxis=dict(axis, autorange="reversed", scaleanchor="x"),
+    )
     return fig
 
 
 # Create DA diff barchart for last two weeks (contracts)
 def make_diff_barchart_DA_actual(df, commodity, spare):
+    if len(df) < 2:
+        return make_empty_chart(
+            commodity
+            + " Disaggregated Report Contract Positions<br>(week-over-week change) (DA)"
+        )
     class_long = [
         "producer",
         "swap",
@@ -951,39 +1897,28 @@ def make_diff_barchart_DA_actual(df, commodity, spare):
     ]
 
     longs = [
-        df.iloc[1]["prod_long_all"] - df.iloc[0]["prod_long_all"],
-        df.iloc[1]["swap_long_all"] - df.iloc[0]["swap_long_all"],
-        df.iloc[1]["money_long_all"] - df.iloc[0]["money_long_all"],
-        df.iloc[1]["other_long_all"] - df.iloc[0]["other_long_all"],
-        df.iloc[1]["total_report_long_all"] - df.iloc[0]["total_report_long_all"],
-        df.iloc[1]["nonreport_long_all"] - df.iloc[0]["nonreport_long_all"],
-        (df.iloc[1]["total_report_long_all"] + df.iloc[1]["nonreport_long_all"])
-        - (df.iloc[0]["total_report_long_all"] + df.iloc[0]["nonreport_long_all"]),
+        df.iloc[-1]["prod_long_all_wow"],
+        df.iloc[-1]["swap_long_all_wow"],
+        df.iloc[-1]["money_long_all_wow"],
+        df.iloc[-1]["other_long_all_wow"],
+        df.iloc[-1]["total_report_long_all_wow"],
+        df.iloc[-1]["nonreport_long_all_wow"],
+        df.iloc[-1]["total_long_all_wow"],
     ]
     shorts = [
-        df.iloc[1]["prod_short_all"] - df.iloc[0]["prod_short_all"],
-        df.iloc[1]["swap_short_all"] - df.iloc[0]["swap_short_all"],
-        df.iloc[1]["money_short_all"] - df.iloc[0]["money_short_all"],
-        df.iloc[1]["other_short_all"] - df.iloc[0]["other_short_all"],
-        df.iloc[1]["total_report_short_all"] - df.iloc[0]["total_report_short_all"],
-        df.iloc[1]["nonreport_short_all"] - df.iloc[0]["nonreport_short_all"],
-        (df.iloc[1]["total_report_short_all"] + df.iloc[1]["nonreport_short_all"])
-        - (df.iloc[0]["total_report_short_all"] + df.iloc[0]["nonreport_short_all"]),
+        df.iloc[-1]["prod_short_all_wow"],
+        df.iloc[-1]["swap_short_all_wow"],
+        df.iloc[-1]["money_short_all_wow"],
+        df.iloc[-1]["other_short_all_wow"],
+        df.iloc[-1]["total_report_short_all_wow"],
+        df.iloc[-1]["nonreport_short_all_wow"],
+        df.iloc[-1]["total_short_all_wow"],
     ]
     spreads = [
-        df.iloc[1]["swap_spread_all"] - df.iloc[0]["swap_spread_all"],
-        df.iloc[1]["money_spread_all"] - df.iloc[0]["money_spread_all"],
-        df.iloc[1]["other_spread_all"] - df.iloc[0]["other_spread_all"],
-        (
-            df.iloc[1]["swap_spread_all"]
-            + df.iloc[1]["money_spread_all"]
-            + df.iloc[1]["other_spread_all"]
-            - (
-                df.iloc[0]["swap_spread_all"]
-                + df.iloc[0]["money_spread_all"]
-                + df.iloc[0]["other_spread_all"]
-            )
-        ),
+        df.iloc[-1]["swap_spread_all_wow"],
+        df.iloc[-1]["money_spread_all_wow"],
+        df.iloc[-1]["other_spread_all_wow"],
+        df.iloc[-1]["spread_all_wow"],
     ]
 
     fig = go.Figure(
@@ -1023,9 +1958,9 @@ def make_diff_barchart_DA_actual(df, commodity, spare):
         newshape=dict(line_color="yellow"),
         title=commodity
         + " Disaggregated Report Contract Positions<br>(week-over-week change) (DA): "
-        + df.index[1]
+        + report_date(df.index[1])
         + " - "
-        + df.index[0],
+        + report_date(df.index[0]),
         xaxis_title="",
         yaxis_title="Contracts",
     )
@@ -1033,6 +1968,45 @@ def make_diff_barchart_DA_actual(df, commodity, spare):
     return fig
 
 
+# Reduce the weekly series for a 3D surface to at most max_weeks columns
+# x is the report dates, z a list of series over them
+# Returns x and z unchanged when the range is already short enough
+def surface_lod(x, z, max_weeks=None, how=None):
+    if max_weeks is None:
+        max_weeks = surface_max_weeks
+    if how is None:
+        how = surface_binning
+    if not max_weeks or len(x) <= max_weeks:
+        return x, z
+
+    values = np.vstack([np.asarray(series, dtype="float64") for series in z])
+    dates = np.asarray(x)
+
+    # The envelope can put a column in each bin for every series' low and
+    # high, so it gets fewer bins
+    bins = max_weeks // (2 * len(values)) if how == "envelope" else max_weeks
+    starts = np.linspace(0, len(x), max(1, bins), endpoint=False).astype(int)
+    ends = np.r_[starts[1:], len(x)] - 1
+
+    if how == "last":
+        return dates[ends], values[:, ends]
+    if how == "envelope":
+        # The series share the x axis, so each bin keeps the weeks where any
+        # of them is at its low or high, in date order.  Every column is a
+        # real week and every series' extremes land on the week they happened.
+        columns = []
+        for start, end in zip(starts, ends + 1):
+            block = values[:, start:end]
+            extremes = np.r_[block.argmin(axis=1), block.argmax(axis=1)]
+            columns.append(start + np.unique(extremes))
+        columns = np.concatenate(columns)
+        return dates[columns], values[:, columns]
+    if how == "mean":
+        sums = np.add.reduceat(values, starts, axis=1)
+        return dates[ends], sums / (ends - starts + 1)
+    raise ValueError("Unknown surface binning: " + str(how))
+
+
 def da_3d_surface(df, commodity):
     # This is an experiment in charting the DA for a commodity in 3d
     # We'll use the net values to give a postive-negative view
@@ -1045,12 +2019,13 @@ def da_3d_surface(df, commodity):
     ]
 
     z_data = [
-        df["prod_long_all"] - df["prod_short_all"],
-        df["nonreport_long_all"] - df["nonreport_short_all"],
-        df["swap_long_all"] - df["swap_short_all"],
-        df["money_long_all"] - df["money_short_all"],
-        df["other_long_all"] - df["other_short_all"],
+        df["prod_net_all"],
+        df["nonreport_net_all"],
+        df["swap_net_all"],
+        df["money_net_all"],
+        df["other_net_all"],
     ]
+    x_data, z_data = surface_lod(df.index, z_data)
 
     fig = go.Figure(
         go.Surface(
@@ -1064,7 +2039,7 @@ def da_3d_surface(df, commodity):
                     "color": "black",
                 },
             },
-            x=df.index,
+            x=x_data,
             y=y_data,
             z=z_data,
         )
@@ -1072,9 +2047,9 @@ def da_3d_surface(df, commodity):
     fig.update_layout(
         title=commodity
         + " Disaggregated Report Net Positions<br>(DA): "
-        + df.index.values[0]
+        + report_date(df.index[0])
         + " - "
-        + df.index.values[-1],
+        + report_date(df.index[-1]),
         scene={
             "xaxis_title": "",
             "yaxis_title": "",
@@ -1124,6 +2099,7 @@ def da_3d_surface_all(df, commodity):
         df["swap_long_all"],
         df["money_long_all"],
     ]
+    x_data, z_data = surface_lod(df.index, z_data)
 
     fig = go.Figure(
         go.Surface(
@@ -1137,7 +2113,7 @@ def da_3d_surface_all(df, commodity):
                     "color": "black",
                 },
             },
-            x=df.index,
+            x=x_data,
             y=y_data,
             z=z_data,
         )
@@ -1147,9 +2123,9 @@ def da_3d_surface_all(df, commodity):
     fig.update_layout(
         title=commodity
         + " Disaggregated Report Actual Positions<br>(DA): "
-        + df.index.values[0]
+        + report_date(df.index[0])
         + " - "
-        + df.index.values[-1],
+        + report_date(df.index[-1]),
         scene=dict(
             xaxis_title="",
             yaxis=dict(
@@ -0,0 +1,121 @@
+"""
+    Shared fixtures for the tests
+
+    The tests run the real download, weekly update and processing code
+    against a local web server standing in for the CFTC site, so they need
+    no network access.  The reports it serves are the synthetic ones from
+    benchmark.py.
+"""
+import functools
+import http.server
+import os
+import sys
+import threading
+import time
+import zipfile
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark  # noqa: E402
+import support_functions as sf  # noqa: E402
+
+# Kept small so a full reprocess of the reports is quick
+markets = 12
+years = 2
+
+
+# Serves the files in a directory, counting the requests for each path and
+# how many were being answered at once
+# server.delay holds each response back, server.failures answers a path with
+# a 503 that many times before serving it
+class ReportHandler(http.server.SimpleHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests[self.path] = server.requests.get(self.path, 0) + 1
+            server.in_flight += 1
+            server.most_in_flight = max(server.most_in_flight, server.in_flight)
+            failing = server.failures.get(self.path, 0) > 0
+            if failing:
+                server.failures[self.path] -= 1
+        try:
+            time.sleep(server.delay)
+            if failing:
+                self.send_error(503)
+            else:
+                super().do_GET()
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+# A stand in for the CFTC site serving whatever is put in its path, with
+# base_path and base_url pointed at it
+@pytest.fixture
+def report_server(tmp_path, monkeypatch):
+    site = tmp_path / "site"
+    data = tmp_path / "data"
+    site.mkdir()
+    data.mkdir()
+
+    handler = functools.partial(ReportHandler, directory=str(site))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.lock = threading.Lock()
+    server.requests = {}
+    server.failures = {}
+    server.delay = 0
+    server.in_flight = 0
+    server.most_in_flight = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:" + str(server.server_address[1]) + "/"
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sf, "base_path", str(data) + "/")
+    monkeypatch.setattr(sf, "base_url", url)
+    monkeypatch.setattr(sf, "download_backoff", 0)
+
+    yield {"path": site, "url": url, "server": server}
+    server.shutdown()
+    server.server_close()
+
+
+# The stand in serving synthetic reports
+# Each year is zipped the way the CFTC publishes it, minus the last week,
+# which is served on its own as the weekly files - no header row, just like
+# the real ones
+@pytest.fixture
+def cftc_site(report_server, tmp_path, monkeypatch):
+    site = report_server["path"]
+    source = tmp_path / "source"
+    source.mkdir()
+    year_list = benchmark.make_synthetic_reports(str(source), years, markets)
+
+    reports = [
+        ("deacot", "deacot", "annual.txt", "deafut.txt"),
+        ("deacot_DA_", "fut_disagg_txt_", "f_year.txt", "f_disagg.txt"),
+    ]
+    for file_name, zip_name, member, weekly_name in reports:
+        for year in year_list:
+            df = pd.read_csv(source / (file_name + year + ".txt"))
+            if year == year_list[-1]:
+                date_col = df.columns[1]
+                last_week = df[date_col] == df[date_col].max()
+                df[last_week].to_csv(site / weekly_name, header=False, index=False)
+                df = df[~last_week]
+            with zipfile.ZipFile(site / (zip_name + year + ".zip"), "w") as zf:
+                zf.writestr(member, df.to_csv(index=False))
+
+    url = report_server["url"]
+    monkeypatch.setattr(sf, "analysis_years", year_list)
+    monkeypatch.setattr(sf, "cache_path", str(tmp_path / "processed") + "/")
+    monkeypatch.setattr(
+        sf,
+        "weekly_urls",
+        {"deacot": url + "deafut.txt", "da": url + "f_disagg.txt"},
+    )
+    return dict(report_server, years=year_list)
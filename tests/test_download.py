@@ -0,0 +1,76 @@
+"""
+    Report downloads against a local stand in for the CFTC site
+"""
+import urllib.error
+import zipfile
+import pytest
+import support_functions as sf
+
+years = ["2020", "2021", "2022"]
+
+
+# Zip up a small report for each year the way the CFTC publishes them
+# Returns the expected contents of each yearly file and the zip it comes
+# from, by the file's path
+def publish(site, years):
+    expected = {}
+    for year in years:
+        for zip_name, member, file_name in [
+            ("deacot", "annual.txt", "deacot"),
+            ("fut_disagg_txt_", "f_year.txt", "deacot_DA_"),
+        ]:
+            text = "Name,Date\n" + file_name + " report," + year + "-01-04\n"
+            zip_path = site / (zip_name + year + ".zip")
+            with zipfile.ZipFile(zip_path, "w") as zf:
+                zf.writestr(member, text)
+            expected[sf.base_path + file_name + year + ".txt"] = (text, zip_path)
+    return expected
+
+
+def test_every_year_is_fetched_at_once(report_server, monkeypatch):
+    expected = publish(report_server["path"], years)
+    server = report_server["server"]
+    # Long enough for the downloads to overlap if they run in parallel
+    server.delay = 0.2
+    monkeypatch.setattr(sf, "download_workers", 4)
+
+    summary = sf.get_reports(years)
+
+    assert server.most_in_flight > 1
+    assert len(server.requests) == len(expected)
+    assert sorted(s["file"] for s in summary) == sorted(expected)
+    for s in summary:
+        text, zip_path = expected[s["file"]]
+        with open(s["file"]) as f:
+            assert f.read() == text
+        # The bytes reported are the zip as served
+        assert s["bytes"] == zip_path.stat().st_size
+        assert s["seconds"] >= server.delay
+
+
+def test_current_files_are_not_fetched_again(report_server):
+    publish(report_server["path"], years)
+    sf.get_reports(years)
+    requests = dict(report_server["server"].requests)
+
+    assert sf.get_reports(years) == []
+    assert report_server["server"].requests == requests
+
+
+def test_server_errors_are_retried(report_server):
+    expected = publish(report_server["path"], ["2022"])
+    server = report_server["server"]
+    server.failures["/deacot2022.zip"] = sf.download_retries - 1
+
+    summary = sf.get_reports(["2022"])
+
+    assert server.requests["/deacot2022.zip"] == sf.download_retries
+    assert sorted(s["file"] for s in summary) == sorted(expected)
+
+
+def test_client_errors_are_not_retried(report_server):
+    # 2022 hasn't been published
+    publish(report_server["path"], ["2021"])
+    with pytest.raises(urllib.error.HTTPError):
+        sf.get_reports(["2021", "2022"])
+    assert report_server["server"].requests["/deacot2022.zip"] == 1
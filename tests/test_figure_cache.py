@@ -0,0 +1,46 @@
+"""
+    Pre-serialized figure store
+"""
+import json
+import threading
+import plotly.graph_objects as go
+import figure_cache as fc
+
+
+def figure(title):
+    return go.Figure(layout=dict(title=title))
+
+
+def test_bytes_are_found_by_chart_exchange_and_version():
+    store = fc.FigureStore()
+    store.add(("da_bar", "GOLD", None, "v1"), figure("bar"))
+    store.add(("da_3d_net", "GOLD", (1, 52), "v1"), figure("surface"))
+    store.add(("da_bar", "SILVER", None, "v1"), figure("silver"))
+
+    raw = store.get_bytes("da_3d_net", "GOLD", "v1")
+    assert json.loads(raw)["layout"]["title"]["text"] == "surface"
+    assert store.get_bytes("da_bar", "GOLD", "v2") is None
+
+    store.clear()
+    assert store.get_bytes("da_bar", "GOLD", "v1") is None
+
+
+def test_hits_are_counted_across_threads():
+    store = fc.FigureStore()
+    key = ("da_bar", "GOLD", None, "v1")
+    store.add(key, figure("bar"))
+
+    def read():
+        for _ in range(1000):
+            store.get(key)
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = store.stats()
+    assert stats["hits"] == 8000
+    assert stats["figures"] == 1
+    assert stats["exchanges"] == 1
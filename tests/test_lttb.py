@@ -0,0 +1,116 @@
+"""
+    Largest-Triangle-Three-Buckets downsampling against a plain reference
+"""
+import math
+import numpy as np
+import pandas as pd
+import pytest
+import support_functions as sf
+
+
+# Steinarsson's LTTB, point by point, with the gap handling lttb_indices
+# documents: gaps are left out of the bucket averages (a bucket of nothing
+# but gaps defers to the next one with data), never kept over a real point,
+# and never become the point the next triangle is measured from
+def reference_lttb(x, y, threshold):
+    n = len(x)
+    every = (n - 2) / (threshold - 2)
+
+    def bucket(i):
+        start = int(math.floor(i * every)) + 1
+        stop = min(int(math.floor((i + 1) * every)) + 1, n - 1)
+        return range(start, stop)
+
+    def average(i):
+        points = bucket(i) if i < threshold - 2 else [n - 1]
+        real = [j for j in points if not math.isnan(y[j])]
+        if real:
+            return (
+                sum(x[j] for j in real) / len(real),
+                sum(y[j] for j in real) / len(real),
+            )
+        if i < threshold - 2:
+            return average(i + 1)
+        return None
+
+    keep = [0]
+    anchor = 0 if not math.isnan(y[0]) else None
+    for i in range(threshold - 2):
+        ahead = average(i + 1)
+        behind = (x[anchor], y[anchor]) if anchor is not None else ahead
+        ahead = ahead or behind
+        if behind is None:
+            behind = ahead = (0.0, 0.0)
+        (ax, ay), (nx, ny) = behind, ahead
+        best, best_area = None, -1.0
+        for j in bucket(i):
+            if math.isnan(y[j]):
+                continue
+            area = abs((ax - nx) * (y[j] - ay) - (ax - x[j]) * (ny - ay))
+            if area > best_area:
+                best, best_area = j, area
+        if best is None:
+            keep.append(bucket(i)[0])
+        else:
+            keep.append(best)
+            anchor = best
+    keep.append(n - 1)
+    return keep
+
+
+# A random walk well away from zero, so a gap counted as 0 would drag any
+# average it's in a long way
+def random_walk(n, seed):
+    rng = np.random.default_rng(seed)
+    return 1000 + np.cumsum(rng.normal(0, 10, n))
+
+
+@pytest.mark.parametrize("n, threshold", [(500, 50), (1000, 97), (103, 100)])
+def test_matches_reference(n, threshold):
+    x = np.arange(n, dtype="float64") * 7
+    y = random_walk(n, n)
+    keep = sf.lttb_indices(x, y, threshold)
+    assert keep.tolist() == reference_lttb(x.tolist(), y.tolist(), threshold)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_gaps_match_reference(seed):
+    n, threshold = 800, 60
+    x = np.arange(n, dtype="float64")
+    y = random_walk(n, seed)
+    rng = np.random.default_rng(seed)
+    # Scattered gaps, plus runs long enough to empty whole buckets
+    y[rng.choice(n, 80, replace=False)] = np.nan
+    y[200:260] = np.nan
+    y[500:530] = np.nan
+    keep = sf.lttb_indices(x, y, threshold)
+    assert keep.tolist() == reference_lttb(x.tolist(), y.tolist(), threshold)
+
+
+def test_gaps_are_only_kept_for_buckets_with_no_data():
+    n, threshold = 400, 40
+    x = np.arange(n, dtype="float64")
+    y = random_walk(n, 1)
+    y[100:160] = np.nan
+    keep = sf.lttb_indices(x, y, threshold)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    for i, j in enumerate(keep[1:-1]):
+        bucket = y[edges[i] : edges[i + 1]]
+        assert np.isnan(y[j]) == np.isnan(bucket).all()
+
+
+def test_leading_gap_and_dates():
+    n, threshold = 300, 30
+    x = pd.date_range("2010-01-05", periods=n, freq="7D")
+    y = random_walk(n, 2)
+    y[:40] = np.nan
+    keep = sf.lttb_indices(x, y, threshold)
+    expected = reference_lttb(x.asi8.astype("float64").tolist(), y.tolist(), threshold)
+    assert keep.tolist() == expected
+    # The first bucket with data keeps a real point
+    assert not np.isnan(y[keep[1:-1]]).all()
+
+
+def test_short_series_are_unchanged():
+    assert sf.lttb_indices(range(10), range(10), 10).tolist() == list(range(10))
@@ -0,0 +1,61 @@
+"""
+    Reading and joining reports without losing the compact dtypes
+"""
+import numpy as np
+import pandas as pd
+import benchmark
+import report_schemas as rs
+import support_functions as sf
+
+
+def position_columns(report_name):
+    return [col for col, dtype in rs.dtypes(report_name).items() if dtype == "int32"]
+
+
+def test_a_year_with_gaps_keeps_the_other_years_compact(tmp_path, monkeypatch):
+    monkeypatch.setattr(sf, "base_path", str(tmp_path) + "/")
+    years = benchmark.make_synthetic_reports(str(tmp_path), 2, 5)
+    # Blank out one count in the first year, so that year is read as float32
+    file_path = sf.report_files("da", years[:1])[0]
+    gap = position_columns("da")[0]
+    df = pd.read_csv(file_path)
+    df[gap] = df[gap].astype("object")
+    df.loc[3, gap] = ""
+    df.to_csv(file_path, index=False)
+
+    df = sf.aggregate_reports("da", years, workers=1)
+
+    assert df[gap].dtype == "float32"
+    assert df[gap].isna().sum() == 1
+    for col in position_columns("da")[1:]:
+        assert df[col].dtype == "int32", col
+    assert isinstance(df["Market_and_Exchange_Names"].dtype, pd.CategoricalDtype)
+    assert not (df.dtypes == "float64").any()
+
+
+def test_appended_rows_keep_the_frame_dtypes():
+    df = pd.DataFrame(
+        {
+            "Exchange": pd.Categorical(["A", "B"]),
+            "long": np.array([1, 2], dtype="int32"),
+            "short": np.array([3, 4], dtype="int32"),
+            "pct": np.array([0.5, 0.25], dtype="float32"),
+        }
+    )
+    # New rows read with float32 counts, one of them missing
+    df_new = pd.DataFrame(
+        {
+            "Exchange": pd.Categorical(["C"]),
+            "long": np.array([5], dtype="float32"),
+            "short": np.array([np.nan], dtype="float32"),
+            "pct": np.array([0.125], dtype="float32"),
+        }
+    )
+
+    df = sf.append_processed(df, df_new)
+
+    assert list(df["Exchange"].cat.categories) == ["A", "B", "C"]
+    assert df["long"].dtype == "int32"
+    assert df["short"].dtype == "float32"
+    assert df["pct"].dtype == "float32"
+    np.testing.assert_array_equal(df["long"], [1, 2, 5])
@@ -0,0 +1,58 @@
+"""
+    Level of detail for the 3D surfaces
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import support_functions as sf
+
+weeks = 500
+max_weeks = 40
+
+
+# One series rising every week and one falling, over consecutive weeks
+def monotonic_series():
+    dates = pd.date_range("2015-01-06", periods=weeks, freq="7D")
+    rising = np.arange(weeks, dtype="float64")
+    return dates, [rising, -rising]
+
+
+@pytest.mark.parametrize("how", ["mean", "last", "envelope"])
+def test_binned_weeks_stay_in_date_order(how):
+    dates, z = monotonic_series()
+    x, values = sf.surface_lod(dates, z, max_weeks, how)
+
+    assert len(x) <= max_weeks
+    assert len(x) > 1
+    assert np.isin(x, dates).all()
+    # Dates only move forward, so each series keeps its direction
+    assert (np.diff(x) > np.timedelta64(0)).all()
+    assert (np.diff(values[0]) > 0).all()
+    assert (np.diff(values[1]) < 0).all()
+
+    if how != "mean":
+        # The values are what each series was on the week shown
+        positions = dates.get_indexer(pd.DatetimeIndex(x))
+        for series, binned in zip(z, values):
+            np.testing.assert_array_equal(binned, series[positions])
+
+
+def test_envelope_keeps_the_extremes_where_they_fell():
+    dates, z = monotonic_series()
+    # A spike and a dip part way through a bin
+    z[0][123] = 10000
+    z[1][321] = -10000
+    x, values = sf.surface_lod(dates, z, max_weeks, "envelope")
+
+    assert x[values[0].argmax()] == dates[123]
+    assert x[values[1].argmin()] == dates[321]
+    assert values[0].min() == z[0].min()
+    assert values[1].max() == z[1].max()
+
+
+def test_short_ranges_are_unchanged():
+    dates, z = monotonic_series()
+    dates = dates[:max_weeks]
+    x, values = sf.surface_lod(dates, z, max_weeks, "envelope")
+    assert x is dates
+    assert values is z
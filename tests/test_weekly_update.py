@@ -0,0 +1,83 @@
+"""
+    Weekly updates against a full reload
+
+    A data set brought up to date with the weekly files has to match one
+    processed from scratch out of the same yearly files - the processed
+    reports, and the rolling statistics and screener rolled forward over
+    the new week.
+"""
+import numpy as np
+import pandas as pd
+import rolling_stats as rst
+import screener as sc
+import support_functions as sf
+
+
+# Process every yearly file from scratch into a fresh cache
+def full_reload(tmp_path, monkeypatch):
+    monkeypatch.setattr(sf, "cache_path", str(tmp_path / "reload") + "/")
+    return sf.load_reports()
+
+
+# Load the reports the way the dashboard does, with the derived data a
+# running dashboard keeps alongside
+def load():
+    data = sf.load_reports()
+    sc.add_screener(data)
+    rst.add_rolling(data)
+    return data
+
+
+def test_update_matches_full_reload(cftc_site, tmp_path, monkeypatch):
+    data = load()
+    new_data = sf.update_reports(data)
+    assert new_data is not None
+    sc.add_screener(new_data, data)
+    rst.add_rolling(new_data, data)
+
+    expected = full_reload(tmp_path, monkeypatch)
+    # The yearly files were kept in step, so even the version agrees
+    assert new_data["data_version"] == expected["data_version"]
+    for report_name in ["deacot", "da"]:
+        df = new_data["df_" + report_name]
+        df_expected = expected["df_" + report_name]
+        assert len(df) > len(data["df_" + report_name])
+        pd.testing.assert_frame_equal(
+            df, df_expected[df.columns], check_categorical=False
+        )
+        np.testing.assert_equal(
+            new_data[report_name + "_index"], expected[report_name + "_index"]
+        )
+
+        # Only the new week went through the running windows
+        np.testing.assert_allclose(
+            new_data[report_name + "_rolling"].to_numpy(),
+            rst.compute(df_expected, report_name).to_numpy(),
+            rtol=1e-5,
+            atol=1e-2,
+        )
+        assert new_data["rolling_states"][report_name]
+
+    # Rolling the screener forward over the new week matches a rebuild
+    screener = sc.build(expected["df_da"])
+    for class_name in sc.classes:
+        pd.testing.assert_frame_equal(
+            new_data["screener"].table(class_name).reset_index(drop=True),
+            screener.table(class_name).reset_index(drop=True),
+            check_categorical=False,
+        )
+
+    # Nothing new the second time round
+    assert sf.update_reports(new_data) is None
+
+
+def test_weekly_rows_outside_analysis_years_are_ignored(cftc_site, monkeypatch):
+    monkeypatch.setattr(sf, "analysis_years", cftc_site["years"][:-1])
+    data = sf.load_reports()
+    source = max(sf.report_files("da"))
+    with open(source, "rb") as f:
+        before = f.read()
+
+    assert sf.update_reports(data) is None
+    with open(source, "rb") as f:
+        assert f.read() == before